@@ -0,0 +1,169 @@
+import hashlib
+import os
+import Queue
+import time
+
+from panda3d.core import Filename, TextureStage, VirtualFileSystem, getModelPath
+
+# extensions tried, in order, for a model named without one
+_MODEL_EXTENSIONS = ('.bam', '.egg', '.egg.pz')
+
+class AssetRegistry(object):
+    # one place to get textures, texture stages and models from. Each asset
+    # is loaded once and shared; models hand out copies of a loaded
+    # prototype. Models stored as .egg/.egg.pz are converted to .bam in
+    # cacheDir (by default a .bamcache directory next to the source) and
+    # read from there while the bam is newer than its source.
+    def __init__(self, cacheDir=None):
+        self.cacheDir = cacheDir
+        self._textures = dict()
+        self._stages = dict()
+        self._models = dict()
+        self._pending = dict()
+        self._times = dict()
+        self._hits = 0
+        self._bamWrites = 0
+        # textures have no async loader call; a worker thread loads them and
+        # a main thread task stores the results
+        self._loadedTextures = Queue.Queue()
+        self._texturesInFlight = 0
+        self._collectTask = None
+
+    def model(self, path, parent=None):
+        # a copy of the model at path, parented to parent if given
+        prototype = self._models.get(path)
+        if prototype is None:
+            start = time.time()
+            source, bam = self._modelFiles(path)
+            prototype = loader.loadModel(Filename.fromOsSpecific(bam or source))
+            self._storeModel(path, source, bam, prototype, start)
+        else:
+            self._hits += 1
+        return prototype.copyTo(parent if parent is not None else hidden)
+
+    def preload(self, models=(), textures=(), callback=None):
+        # starts loading in the background; callback() runs once all are in
+        remaining = [path for path in models if path not in self._models and path not in self._pending]
+        remaining += [path for path in textures if path not in self._textures and path not in self._pending]
+        if not remaining:
+            if callback is not None:
+                callback()
+            return
+
+        waiting = set(remaining)
+        def done(path):
+            waiting.discard(path)
+            if not waiting and callback is not None:
+                callback()
+
+        for path in remaining:
+            start = time.time()
+            self._pending[path] = start
+            if path in models:
+                source, bam = self._modelFiles(path)
+                loader.loadModel(Filename.fromOsSpecific(bam or source),
+                                 callback=self._modelLoaded, extraArgs=[path, source, bam, start, done])
+            else:
+                if not taskMgr.hasTaskChain('assets'):
+                    taskMgr.setupTaskChain('assets', numThreads=1)
+                self._texturesInFlight += 1
+                taskMgr.add(self._loadTexture, 'load-' + path, extraArgs=[path, start, done],
+                            taskChain='assets')
+                if self._collectTask is None:
+                    self._collectTask = taskMgr.add(self._collectTextures, 'collect-textures')
+
+    def stats(self):
+        # load counts and seconds spent loading, slowest assets first
+        slowest = sorted(self._times.iteritems(), key=lambda item: -item[1])
+        return {
+            'loaded': len(self._times),
+            'hits': self._hits,
+            'pending': len(self._pending),
+            'bamWrites': self._bamWrites,
+            'seconds': sum(self._times.itervalues()),
+            'slowest': slowest[:10],
+        }
+
+    def texture(self, path):
+        tex = self._textures.get(path)
+        if tex is None:
+            start = time.time()
+            tex = loader.loadTexture(path)
+            self._storeTexture(path, tex, start)
+        else:
+            self._hits += 1
+        return tex
+
+    def textureStage(self, name):
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = TextureStage(name)
+        return stage
+
+    def _modelFiles(self, path):
+        # (source file, up to date bam or None)
+        source = self._resolve(path)
+        if source.endswith('.bam'):
+            return source, None
+        bam = self._bamPath(source)
+        if os.path.exists(bam) and os.path.getmtime(bam) >= os.path.getmtime(source):
+            return source, bam
+        return source, None
+
+    def _bamPath(self, source):
+        # named after the whole source path, so sources sharing a file name
+        # do not share a bam in a common cacheDir
+        digest = hashlib.sha1(os.path.abspath(source)).hexdigest()[:16]
+        name = '{0}-{1}.bam'.format(os.path.basename(source), digest)
+        cacheDir = self.cacheDir or os.path.join(os.path.dirname(source), '.bamcache')
+        return os.path.join(cacheDir, name)
+
+    def _modelLoaded(self, prototype, path, source, bam, start, done):
+        self._storeModel(path, source, bam, prototype, start)
+        done(path)
+
+    def _resolve(self, path):
+        vfs = VirtualFileSystem.getGlobalPtr()
+        if os.path.splitext(path)[1] in ('.bam', '.egg', '.pz'):
+            candidates = [path]
+        else:
+            candidates = [path + ext for ext in _MODEL_EXTENSIONS]
+        for candidate in candidates:
+            fn = Filename.fromOsSpecific(candidate)
+            # the vfs also finds foo.egg as foo.egg.pz, so check the real file
+            if vfs.resolveFilename(fn, getModelPath().getValue()) and os.path.exists(fn.toOsSpecific()):
+                return fn.toOsSpecific()
+        raise IOError('Could not find model ' + path)
+
+    def _storeModel(self, path, source, bam, prototype, start):
+        self._pending.pop(path, None)
+        self._models[path] = prototype
+        self._times[path] = time.time() - start
+        if bam is None and not source.endswith('.bam'):
+            bam = self._bamPath(source)
+            if not os.path.isdir(os.path.dirname(bam)):
+                os.makedirs(os.path.dirname(bam))
+            if prototype.writeBamFile(Filename.fromOsSpecific(bam)):
+                self._bamWrites += 1
+
+    def _storeTexture(self, path, tex, start):
+        self._pending.pop(path, None)
+        self._textures[path] = tex
+        self._times[path] = time.time() - start
+
+    def _collectTextures(self, task):
+        while not self._loadedTextures.empty():
+            path, tex, start, done = self._loadedTextures.get()
+            self._texturesInFlight -= 1
+            self._storeTexture(path, tex, start)
+            done(path)
+        if self._texturesInFlight:
+            return task.cont
+        self._collectTask = None
+        return task.done
+
+    def _loadTexture(self, path, start, done):
+        # runs on the assets task chain
+        self._loadedTextures.put((path, loader.loadTexture(path), start, done))
+
+assets = AssetRegistry()
@@ -0,0 +1,23 @@
+import numpy
+
+# cells of a uniform grid are packed 21 bits an axis into one int64 key,
+# biased so negative cells pack too. As the fields never carry into each
+# other, the key of a neighbouring cell is key + delta, a sum of AXES.
+BIAS = 1 << 20
+MASK = (1 << 21) - 1
+AXES = numpy.array([1 << 42, 1 << 21, 1], numpy.int64)
+
+def cellKey(x, y, z):
+    return ((x + BIAS) << 42) + ((y + BIAS) << 21) + z + BIAS
+
+def cellKeys(cells):
+    # the keys of an n x 3 array of cells
+    cells = cells.astype(numpy.int64) + BIAS
+    return (cells[:, 0] << 42) + (cells[:, 1] << 21) + cells[:, 2]
+
+def unpack(keys):
+    cells = numpy.empty((len(keys), 3), numpy.int64)
+    cells[:, 0] = keys >> 42
+    cells[:, 1] = (keys >> 21) & MASK
+    cells[:, 2] = keys & MASK
+    return cells - BIAS
@@ -0,0 +1,158 @@
+import numpy
+
+# bits of the flags column
+FLAG_SELECTED = 1
+FLAG_HIGHLIGHT = 2
+FLAG_MOVING = 4
+
+# (name, dtype, shape of one value, value of a new entity)
+COLUMNS = (
+    ('position', numpy.float32, (3,), 0),
+    ('owner', numpy.int16, (), -1),
+    ('hull', numpy.float32, (), 1),
+    ('target', numpy.int32, (), -1),
+    ('flags', numpy.uint32, (), 0),
+)
+
+class EntityStore(object):
+    # game entities as rows of typed numpy columns. An entity's id is its
+    # row and never changes while it lives; the rows of destroyed entities
+    # go on a free list and are handed out again. Columns are read and
+    # written as arrays (store['position'][ids]); whoever writes through
+    # such an array calls touch(name) so views know to update.
+    def __init__(self, columns=COLUMNS, capacity=16):
+        self._capacity = capacity
+        self._size = 0
+        self._count = 0
+        self._free = list()
+        self._alive = numpy.zeros(capacity, bool)
+        self._columns = dict()
+        self._defaults = dict()
+        self.names = list()
+        # bumped on every change to a column
+        self.versions = dict()
+        for column in columns:
+            self.addColumn(*column)
+
+    def __contains__(self, id):
+        return 0 <= id < self._size and bool(self._alive[id])
+
+    def __getitem__(self, name):
+        return self._columns[name][:self._size]
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def alive(self):
+        return self._alive[:self._size]
+
+    @property
+    def size(self):
+        # one past the highest row in use; columns are this long
+        return self._size
+
+    def addColumn(self, name, dtype, shape=(), default=0):
+        if name in self._columns:
+            raise KeyError('Column already exists: ' + name)
+        self._columns[name] = numpy.empty((self._capacity,) + tuple(shape), dtype)
+        self._columns[name][...] = default
+        self._defaults[name] = default
+        self.names.append(name)
+        self.versions[name] = 0
+
+    def clearFlags(self, ids, flags):
+        self._columns['flags'][ids] &= ~numpy.uint32(flags)
+        self.touch('flags')
+
+    def create(self, **values):
+        return int(self.createMany(1, **values)[0])
+
+    def createMany(self, count, **values):
+        # values are per column, one for all or one per entity; returns the
+        # new ids
+        unknown = set(values) - set(self.names)
+        if unknown:
+            raise KeyError('No such columns: ' + ', '.join(sorted(unknown)))
+        reused = self._free[-count:] if count else []
+        del self._free[len(self._free) - len(reused):]
+        start = self._size
+        self._grow(start + count - len(reused))
+        self._size = start + count - len(reused)
+        ids = numpy.concatenate((numpy.array(reused[::-1], numpy.int64),
+                                 numpy.arange(start, self._size, dtype=numpy.int64)))
+        self._alive[ids] = True
+        self._count += count
+        for name in self.names:
+            self._columns[name][ids] = values.get(name, self._defaults[name])
+            self.touch(name)
+        return ids
+
+    def destroy(self, ids):
+        # an id given twice is destroyed once, not put on the free list twice
+        ids = numpy.unique(numpy.atleast_1d(ids))
+        if not self._alive[ids].all():
+            raise KeyError('Not alive: ' + repr(ids[~self._alive[ids]].tolist()))
+        self._alive[ids] = False
+        self._count -= len(ids)
+        for name in self.names:
+            self._columns[name][ids] = self._defaults[name]
+            self.touch(name)
+        self._free.extend(ids.tolist())
+
+    def hasColumn(self, name):
+        return name in self._columns
+
+    def ids(self):
+        return numpy.flatnonzero(self.alive)
+
+    def set(self, name, ids, values):
+        self._columns[name][ids] = values
+        self.touch(name)
+
+    def setFlags(self, ids, flags):
+        self._columns['flags'][ids] |= numpy.uint32(flags)
+        self.touch('flags')
+
+    def touch(self, name):
+        self.versions[name] += 1
+
+    def save(self, f):
+        # writes every column and the free list as one .npz
+        arrays = dict(('column_' + name, self[name]) for name in self.names)
+        numpy.savez(f, _alive=self.alive, _free=numpy.array(self._free, numpy.int64),
+                    _names=numpy.array(self.names), **arrays)
+
+    @classmethod
+    def load(cls, f):
+        data = numpy.load(f)
+        names = [str(name) for name in data['_names']]
+        alive = data['_alive']
+        store = cls(columns=(), capacity=max(len(alive), 16))
+        defaults = dict((column[0], column[3]) for column in COLUMNS)
+        for name in names:
+            column = data['column_' + name]
+            store.addColumn(name, column.dtype, column.shape[1:], defaults.get(name, 0))
+            store._columns[name][:len(column)] = column
+        store._size = len(alive)
+        store._alive[:len(alive)] = alive
+        store._count = int(alive.sum())
+        store._free = data['_free'].tolist()
+        return store
+
+    def _grow(self, count):
+        capacity = self._capacity
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
+        for name in self.names:
+            old = self._columns[name]
+            new = numpy.empty((capacity,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            new[len(old):] = self._defaults[name]
+            self._columns[name] = new
+        alive = numpy.zeros(capacity, bool)
+        alive[:self._capacity] = self._alive
+        self._alive = alive
+        self._capacity = capacity
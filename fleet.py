@@ -0,0 +1,97 @@
+import numpy
+
+from entities import EntityStore, FLAG_MOVING
+
+# the columns a Fleet adds to its store
+_COLUMNS = (
+    ('velocity', numpy.float32, (3,), 0),
+    ('destination', numpy.float32, (3,), 0),
+    ('speed', numpy.float32, (), 0),
+)
+
+class Fleet(object):
+    # moves the ships of an EntityStore: each has a position, velocity,
+    # destination and top speed, and travels while its FLAG_MOVING flag is
+    # set. update(dt) moves every travelling ship toward its destination in
+    # one vectorized step; the store's views copy the positions to whatever
+    # draws the ships.
+    def __init__(self, store=None):
+        self.store = store if store is not None else EntityStore()
+        for column in _COLUMNS:
+            if not self.store.hasColumn(column[0]):
+                self.store.addColumn(*column)
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def positions(self):
+        return self.store['position']
+
+    @property
+    def velocities(self):
+        return self.store['velocity']
+
+    @property
+    def destinations(self):
+        return self.store['destination']
+
+    @property
+    def speeds(self):
+        return self.store['speed']
+
+    @property
+    def moving(self):
+        return (self.store['flags'] & FLAG_MOVING) != 0
+
+    def add(self, pos, speed, **values):
+        return int(self.addMany([pos], speed, **values)[0])
+
+    def addMany(self, positions, speed, **values):
+        # speed is one top speed for all or one per ship; other store
+        # columns can be given too. Returns the new ships' ids.
+        positions = numpy.asarray(positions, numpy.float32).reshape(-1, 3)
+        return self.store.createMany(len(positions), position=positions, destination=positions,
+                                     speed=speed, **values)
+
+    def send(self, ships, destinations):
+        # ships is an id or an array of them, destinations one position or
+        # one per ship
+        self.store.set('destination', ships, destinations)
+        self.store.setFlags(ships, FLAG_MOVING)
+
+    def stop(self, ships):
+        self.store.set('destination', ships, self.store['position'][ships])
+        self.store.set('velocity', ships, 0)
+        self.store.clearFlags(ships, FLAG_MOVING)
+
+    def update(self, dt):
+        # moves the travelling ships by up to speed * dt; returns the ids of
+        # the ships that moved. Works on whole columns with idle ships
+        # masked out, which beats gathering the moving rows.
+        store = self.store
+        flags = store['flags']
+        moving = (flags & FLAG_MOVING) != 0
+        ships = numpy.flatnonzero(moving)
+        if not len(ships) or dt <= 0:
+            return ships[:0]
+        positions = store['position']
+        destinations = store['destination']
+        speeds = store['speed']
+        delta = destinations - positions
+        distance = numpy.sqrt(numpy.einsum('ij,ij->i', delta, delta))
+        step = speeds * numpy.float32(dt)
+        arrived = moving & (step >= distance)
+        travelling = moving & ~arrived
+        distance[~travelling] = 1
+        scale = numpy.where(travelling, step / distance, arrived)
+        positions += delta * scale[:, numpy.newaxis]
+        numpy.copyto(positions, destinations, where=arrived[:, numpy.newaxis])
+        numpy.multiply(delta, (travelling * speeds / distance)[:, numpy.newaxis], out=store['velocity'])
+        store.touch('position')
+        store.touch('velocity')
+        # views redraw on a flags change, so only touch them on arrivals
+        if arrived.any():
+            flags[arrived] &= ~numpy.uint32(FLAG_MOVING)
+            store.touch('flags')
+        return ships
@@ -0,0 +1,80 @@
+"""Headless benchmark of moving ships.
+
+Sends every ship of a game to a random star and times each tick of the
+fleet: Fleet.update, re-indexing the moved ships for picking
+(PickIndex.moveSlots), and Game.moveShips, which does both. 'pick' is a
+ray cast after each tick, which brings the picking grid up to date with
+that tick's moves. Results are written as JSON and can be compared
+against a stored baseline like guibench.py's:
+
+    python fleetbench.py --output fleet.json
+    python fleetbench.py --baseline fleet.json --tolerance 0.25
+
+The exit status is 1 when a phase got slower than the baseline allows.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy
+
+from game import Game, SEED, TICK_RATE
+from guibench import addReportOptions, report
+
+_PHASES = ('update', 'reindex', 'tick', 'pick')
+
+def runCase(ships, stars, dist, ticks, seed=SEED):
+    game = Game(stars=stars, dist=dist, ships=ships, shipDist=dist, seed=seed)
+    rng = numpy.random.RandomState(seed)
+    ids = game.shipStore.ids()
+    targets = game.starStore['position'][rng.choice(game.starStore.ids(), len(ids))]
+    game.fleet.send(ids, targets)
+    dt = 1.0 / TICK_RATE
+
+    # a ray straight through the middle of the galaxy
+    origin, direction = (dist / 2.0, -dist, dist / 2.0), (0, 1, 0)
+    timings = dict((phase, list()) for phase in _PHASES)
+    for i in xrange(ticks):
+        t = time.time()
+        moved = game.fleet.update(dt)
+        timings['update'].append(time.time() - t)
+        t = time.time()
+        game.pickIndex.moveSlots(game.shipSlots[moved], game.fleet.positions[moved])
+        timings['reindex'].append(time.time() - t)
+    for i in xrange(ticks):
+        t = time.time()
+        game.moveShips(dt)
+        timings['tick'].append(time.time() - t)
+        t = time.time()
+        game.pickIndex.ray(origin, direction)
+        timings['pick'].append(time.time() - t)
+
+    results = dict((phase, float(numpy.median(values))) for phase, values in timings.iteritems())
+    results['moving'] = int(game.fleet.moving.sum())
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark moving ships without a display.')
+    parser.add_argument('--ships', type=int, action='append',
+                        help='ship count to run, may be repeated (default: 10000 and 50000)')
+    parser.add_argument('--stars', type=int, default=1000)
+    parser.add_argument('--dist', type=float, default=400, help='size of the galaxy')
+    parser.add_argument('--ticks', type=int, default=30, help='timed ticks per phase')
+    parser.add_argument('--seed', type=int, default=SEED)
+    addReportOptions(parser)
+    args = parser.parse_args(argv)
+
+    results = dict()
+    for ships in args.ships or (10000, 50000):
+        name = 'ships={0}'.format(ships)
+        phases = runCase(ships, args.stars, args.dist, args.ticks, args.seed)
+        print '{0:12}'.format(name), ' '.join('{0}={1:.4f}'.format(phase, phases[phase])
+                                              for phase in _PHASES), \
+            'moving={0}'.format(phases.pop('moving'))
+        results[name] = phases
+
+    return report(args, results, stars=args.stars, dist=args.dist, ticks=args.ticks)
+
+if __name__ == '__main__':
+    sys.exit(main())
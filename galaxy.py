@@ -0,0 +1,180 @@
+import itertools
+
+import numpy
+
+from cells import AXES, cellKeys
+
+# spectral classes, how common each is and the color a star of it is drawn in
+STAR_TYPES = ('O', 'B', 'A', 'F', 'G', 'K', 'M')
+_TYPE_WEIGHTS = numpy.array([0.01, 0.04, 0.07, 0.12, 0.16, 0.25, 0.35])
+_TYPE_COLORS = numpy.array([
+    (155, 176, 255, 255),
+    (170, 191, 255, 255),
+    (202, 215, 255, 255),
+    (248, 247, 255, 255),
+    (255, 244, 234, 255),
+    (255, 210, 161, 255),
+    (255, 204, 111, 255),
+], numpy.uint8)
+# mean number of planets around a star of each class
+_TYPE_PLANETS = numpy.array([0.5, 1.0, 2.0, 3.0, 3.5, 3.0, 2.0])
+MAX_PLANETS = 9
+
+SHAPES = ('uniform', 'spiral', 'cluster')
+
+_CORNERS = numpy.array(list(itertools.product((0, 1), repeat=3)), numpy.int64)
+
+def _cells(points, size):
+    # (cell key, which half of its cell each point is in along each axis)
+    scaled = points / size
+    cells = numpy.floor(scaled)
+    keys = cellKeys(cells)
+    return keys, scaled - cells >= 0.5
+
+class _Grid(object):
+    # points hashed into cubes twice the radius wide, sorted by cell key so
+    # the points of a cell are one run. Whatever is within radius of a point
+    # is then in the 8 cells of the cell corner it is nearest to.
+    def __init__(self, points, radius):
+        keys, halves = _cells(points, 2.0 * radius)
+        order = numpy.argsort(keys)
+        self.radius = radius
+        self.keys = keys[order]
+        self.points = points[order]
+        self.ids = order
+        # index one past the end of the run each sorted point is in
+        ends = numpy.append(numpy.flatnonzero(self.keys[1:] != self.keys[:-1]) + 1, len(keys))
+        self.ends = numpy.repeat(ends, numpy.diff(numpy.append(0, ends)))
+
+    def conflicts(self, points, before=None):
+        # True for each of points that has a grid point closer than radius.
+        # A point that is also in the grid finds itself, so with before only
+        # grid points whose index is below before count; passing a point's
+        # own index there leaves out itself and every later point.
+        keys, halves = _cells(points, 2.0 * self.radius)
+        # grouped by the corner they are nearest to and sorted by key within
+        # a group, the keys searched for stay sorted, which keeps
+        # searchsorted in cache
+        octants = numpy.dot(halves, (4, 2, 1))
+        order = numpy.argsort(keys)
+        groups = [order[octants[order] == octant] for octant in xrange(len(_CORNERS))]
+        bounds = numpy.cumsum([0] + [len(group) for group in groups])
+        order = numpy.concatenate(groups)
+        keys = keys[order]
+        points = points[order]
+        if before is not None:
+            before = before[order]
+
+        hit = numpy.zeros(len(points), bool)
+        r2 = self.radius * self.radius
+        n = len(self.keys)
+        for octant, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            steps = numpy.where(_CORNERS[octant], AXES, -AXES)
+            for corner in _CORNERS:
+                needles = keys[start:stop] + numpy.dot(steps, corner)
+                lo = numpy.minimum(numpy.searchsorted(self.keys, needles), n - 1)
+                hi = self.ends[lo]
+                live = numpy.flatnonzero((self.keys[lo] == needles) & ~hit[start:stop])
+                k = 0
+                while len(live):
+                    j = lo[live] + k
+                    q = live + start
+                    d = self.points[j] - points[q]
+                    close = numpy.einsum('ij,ij->i', d, d) < r2
+                    if before is not None:
+                        close &= self.ids[j] < before[q]
+                    hit[q[close]] = True
+                    k += 1
+                    live = live[~close & (j + 1 < hi[live])]
+        result = numpy.empty(len(points), bool)
+        result[order] = hit
+        return result
+
+def _uniform(rng, count, dist, **kwargs):
+    return rng.uniform(0, dist, (count, 3))
+
+def _spiral(rng, count, dist, arms=2, twist=3.0, spread=0.25, thickness=0.1, **kwargs):
+    # a flat disc around the center of the dist cube, denser in the middle,
+    # with the stars gathered along logarithmic arms
+    radius = dist / 2.0
+    r = numpy.minimum(rng.exponential(0.35, count), 1.0)
+    arm = rng.randint(0, arms, count)
+    angle = arm * (2 * numpy.pi / arms) + twist * r + rng.normal(0, spread, count) / (r + 0.1)
+    points = numpy.empty((count, 3))
+    points[:, 0] = numpy.cos(angle) * r * radius
+    points[:, 1] = numpy.sin(angle) * r * radius
+    points[:, 2] = rng.normal(0, thickness * radius, count) * (1 - r)
+    return points + radius
+
+def _cluster(rng, count, dist, clusters=8, spread=0.08, **kwargs):
+    # gaussian clumps around centers scattered through the dist cube
+    centers = rng.uniform(0, dist, (clusters, 3))
+    return centers[rng.randint(0, clusters, count)] + rng.normal(0, spread * dist, (count, 3))
+
+_DISTRIBUTIONS = {
+    'uniform': _uniform,
+    'spiral': _spiral,
+    'cluster': _cluster,
+}
+
+class Galaxy(object):
+    # the stars of a generated galaxy as parallel arrays: positions (n x 3
+    # float32), types (indices into STAR_TYPES), colors (RGBA8 by type) and
+    # planetCounts. The planets themselves are planetStars, the index of the
+    # star each one orbits.
+    def __init__(self, positions, types, planetCounts, seed=None):
+        self.seed = seed
+        self.positions = positions
+        self.types = types
+        self.planetCounts = planetCounts
+        self.colors = _TYPE_COLORS[types]
+        self.planetStars = numpy.repeat(numpy.arange(len(positions), dtype=numpy.int32), planetCounts)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def planets(self, index):
+        # indices into planetStars of the planets around star index
+        start = int(self.planetCounts[:index].sum())
+        return numpy.arange(start, start + self.planetCounts[index])
+
+def _place(rng, count, dist, shape, minDistance, maxRounds, options):
+    distribution = _DISTRIBUTIONS[shape]
+    if minDistance <= 0:
+        return distribution(rng, count, dist, **options)
+
+    # dart throwing in batches: every candidate of a batch too close to a
+    # star already placed or to an earlier candidate of the batch is dropped,
+    # and what is left is kept. Batches are sized by how many of the last
+    # batch were kept; one that keeps nothing means the space is full.
+    placed = numpy.empty((0, 3))
+    kept = 0.8
+    for i in xrange(maxRounds):
+        need = count - len(placed)
+        if not need:
+            return placed
+        batch = distribution(rng, int(need / kept) + 1024, dist, **options)
+        points = numpy.concatenate((placed, batch))
+        before = numpy.arange(len(placed), len(points))
+        size = len(batch)
+        batch = batch[~_Grid(points, minDistance).conflicts(batch, before)]
+        if not len(batch):
+            break
+        kept = max(len(batch) / float(size), 0.05)
+        placed = numpy.concatenate((placed, batch[:need]))
+    if len(placed) < count:
+        raise ValueError('Only {0} of {1} stars fit {2} apart'.format(len(placed), count, minDistance))
+    return placed
+
+def generate(count, dist, seed=None, shape='uniform', minDistance=0.0, maxRounds=64, **options):
+    # count stars within a cube of side dist (spiral and cluster shapes may
+    # spill past it), no two closer than minDistance. The same seed gives the
+    # same galaxy. options go to the shape: arms, twist, spread, thickness
+    # for spiral; clusters, spread for cluster.
+    if shape not in _DISTRIBUTIONS:
+        raise ValueError('Unknown galaxy shape ' + repr(shape))
+    rng = numpy.random.RandomState(seed)
+    positions = _place(rng, count, float(dist), shape, minDistance, maxRounds, options)
+    types = rng.choice(len(STAR_TYPES), count, p=_TYPE_WEIGHTS / _TYPE_WEIGHTS.sum()).astype(numpy.uint8)
+    planetCounts = numpy.minimum(rng.poisson(_TYPE_PLANETS[types]), MAX_PLANETS).astype(numpy.uint8)
+    return Galaxy(positions.astype(numpy.float32), types, planetCounts, seed)
@@ -0,0 +1,73 @@
+import numpy
+
+import galaxy
+from entities import EntityStore
+from fleet import Fleet
+from picking import PickIndex
+from simulation import Simulation
+
+# the same seed always makes the same galaxy and fleet
+SEED = 1
+# game logic runs this many times a second, whatever the frame rate
+TICK_RATE = 30
+# how far a ship flies in a second
+SHIP_SPEED = 5.0
+# sizes of stars and ships for picking
+STAR_RADIUS = 1.0
+SHIP_RADIUS = 0.25
+
+class Game(object):
+    # the state and rules of a game with nothing to draw it or read input:
+    # the galaxy's stars, the ships and the groups they are ordered in. It
+    # runs the same under a window (see World in starfighter.py) and
+    # headless (headless.py).
+    def __init__(self, stars=10, dist=15, ships=5, shipDist=2, seed=SEED, rate=TICK_RATE):
+        rng = numpy.random.RandomState(seed)
+        self.galaxy = galaxy.generate(stars, dist, seed=seed, minDistance=1)
+        self.pickIndex = PickIndex()
+
+        self.starStore = EntityStore()
+        self.starStore.addColumn('type', numpy.uint8)
+        self.starStore.addColumn('color', numpy.uint8, (4,), 255)
+        ids = self.starStore.createMany(stars, position=self.galaxy.positions, type=self.galaxy.types,
+                                        color=self.galaxy.colors)
+        self.pickIndex.addMany([('star', i) for i in ids], self.galaxy.positions, STAR_RADIUS)
+
+        self.shipStore = EntityStore()
+        self.fleet = Fleet(self.shipStore)
+        positions = rng.uniform(0, shipDist, (ships, 3))
+        ids = self.fleet.addMany(positions, SHIP_SPEED, owner=0)
+        # the pick index slot of each ship id, so moving ships needs no key
+        # lookups
+        self.shipSlots = numpy.full(self.shipStore.size, -1, numpy.int64)
+        self.shipSlots[ids] = self.pickIndex.addMany([('ship', i) for i in ids], positions, SHIP_RADIUS)
+
+        # groups of [target position, ship ids...]; ships join the last one
+        self.targetStack = [[(0, 0, 0)]]
+
+        self.simulation = Simulation(rate)
+        self.simulation.add(self.moveShips)
+        self.simulation.track(self.shipStore)
+
+    def addTarget(self, pos):
+        # starts a new group heading for pos
+        self.targetStack.append([tuple(pos)])
+
+    def addToGroup(self, ships):
+        # the ships of a group line up at its target
+        e = len(self.targetStack) - 1
+        entry = self.targetStack[e]
+        x, y, z = entry[0]
+        for ship in ships:
+            entry.append(ship)
+            self.fleet.send(ship, (x + (len(entry) - 2) / 10.0, y + e / 10.0, z))
+
+    def moveShips(self, dt):
+        # moves every travelling ship at once, by one tick
+        moved = self.fleet.update(dt)
+        if len(moved):
+            self.pickIndex.moveSlots(self.shipSlots[moved], self.fleet.positions[moved])
+        # a group is done once all its ships arrived, but not the one being built
+        moving = self.fleet.moving
+        self.targetStack = [entry for entry in self.targetStack[:-1]
+                            if moving[entry[1:]].any()] + self.targetStack[-1:]
@@ -1,11 +1,44 @@
 import cairo
+import collections
+import contextlib
+import hashlib
+import heapq
+import json
+import marshal
 import math
 import numpy
+import os
 import pango
 import pangocairo
+import Queue
 import re
+import sys
+import tempfile
+import threading
+import timeit
+import weakref
 
-from panda3d.core import CardMaker, CPTA_uchar, PTA_uchar, Texture, TextureStage, TransformState, VBase2, VBase4, Vec2, TransparencyAttrib, RenderAttrib
+from panda3d.core import CardMaker, PStatCollector, Texture, TextureStage, TransformState, VBase2, VBase4, Vec2, TransparencyAttrib, RenderAttrib
+
+# properties of every component that can change its measured size;
+# subclasses add theirs in _sizeProperties. Changing any other property
+# only repaints, or for _layoutProperties places the children again.
+_SIZE_PROPERTIES = frozenset(['width', 'height', 'minWidth', 'minHeight', 'maxWidth', 'maxHeight'] +
+                             [name + ext for name in ['margin', 'padding', 'border']
+                              for ext in ['Left', 'Top', 'Right', 'Bottom']])
+
+# past this many dirty rectangles the manager repaints their bounding box
+_MAX_DIRTY_RECTS = 16
+
+# edge length in pixels of the cells of the hit-test grid
+_HIT_CELL_SIZE = 64
+
+# height in pixels of each overlay texture; only strips touched by a dirty
+# rectangle are re-uploaded
+_STRIP_HEIGHT = 64
+
+# the open PropertySet.batch(), if any
+_batch = None
 
 _COLOR_RE = re.compile('^#([0-9A-Fa-f]{2})([0-9A-Fa-f]{2})([0-9A-Fa-f]{2})([0-9A-Fa-f]{2})?$')
 def toColor(clr):
@@ -54,12 +87,66 @@ def _makeList(v, le):
             
     return [v for _ in xrange(le)]
             
+_UNSET = object()
+
+class _PropertySpec(object):
+    # describes one property for every instance of a class; the converted
+    # default is computed once and shared
+    __slots__ = ('name', 'defaultValue', 'convertFn', 'defaultInherit', 'names', '_default')
+
+    def __init__(self, name, defaultValue=None, convertFn=None, defaultInherit=False, names=None):
+        self.name = name
+        self.defaultValue = defaultValue
+        self.convertFn = convertFn
+        self.defaultInherit = defaultInherit
+        self.names = names
+        self._default = _UNSET
+
+    def computedDefault(self):
+        if self._default is _UNSET:
+            self._default = _convert(self.defaultValue, self.convertFn)
+        return self._default
+
+def _convert(v, convertFn):
+    try:
+        v = v()
+    except TypeError:
+        pass
+
+    if convertFn is not None:
+        v = convertFn(v)
+    return v
+
+def _spec(name, defaultValue=None, convertFn=None, defaultInherit=False):
+    return (_PropertySpec(name, defaultValue, convertFn, defaultInherit),)
+
+def _compositeSpec(name, names, defaultValue=None, convertFn=None, defaultInherit=False):
+    defaultValue = _makeList(defaultValue, len(names))
+    convertFn = _makeList(convertFn, len(names))
+    return tuple([_PropertySpec(pname, dv, cf, defaultInherit) for pname, cf, dv in
+                  zip(names, convertFn, defaultValue)] + [_PropertySpec(name, names=names)])
+
+def _rectSpec(name, defaultValue=None, convertFn=None, defaultInherit=False):
+    return _compositeSpec(name, [name + ext for ext in ['Left', 'Top', 'Right', 'Bottom']],
+                          defaultValue, convertFn, defaultInherit)
+
 class PropertySet(object):
+    # Properties are declared per class in _properties and merged along the
+    # MRO into one shared schema. An instance only allocates a _Property
+    # record for a property once it is set, styled by a class, inherited or
+    # asked for through getProperty(); every other property reads the
+    # schema's shared default.
+    _properties = ()
+
     def __init__(self, id = '', parent=None):
-        self.id = id
-        self._parent = None
-        self.parent= parent
+        cls = type(self)
+        if '_schema' not in cls.__dict__:
+            cls._buildSchema()
+
+        self._id = id
+        self._styleMap = dict()
         self._props = dict()
+        self._composites = None
         self._children = list()
         self._listeners = dict()
 
@@ -68,10 +155,32 @@ class PropertySet(object):
 
         self.types = []
 
+        self._parent = None
+        self.parent= parent
+
+    @classmethod
+    def _buildSchema(cls):
+        schema = dict()
+        for klass in reversed(cls.__mro__):
+            for spec in klass.__dict__.get('_properties', ()):
+                schema[spec.name] = spec
+        cls._schema = schema
+        cls._inheritNames = frozenset(nm for nm, spec in schema.iteritems() if spec.defaultInherit)
+
     @property
     def classes(self):
         return self._manualClasses + self._autoClasses
 
+    @property
+    def id(self):
+        return self._id
+
+    @id.setter
+    def id(self, v):
+        if v != self._id:
+            self._id = v
+            self._idChanged()
+
     @property
     def parent(self):
         return self._parent
@@ -81,27 +190,50 @@ class PropertySet(object):
         self._setParent(p)
 
     def __getitem__(self, name):
-        return self.getProperty(name).value
+        return self._value(name)
 
     def __setitem__(self, name, v):
-        try:
-            self._props[name].value = v
-        except KeyError:
-            prop = self.addProperty(name)
-            prop.value = v
+        self.getProperty(name).value = v
 
     def addClass(self, cl):
         self._manualClasses.append(cl)
+        self._refreshStyle()
         self._updateInheritAll()
 
     def addCompositeProperty(self, name, names, defaultValue=None, convertFn=None, defaultInherit=False):
-        defaultValue = _makeList(defaultValue, len(names))
-        convertFn = _makeList(convertFn, len(names))
-        props = [self.addProperty(pname, dv, cf, defaultInherit) for pname, cf, dv in
-                 zip(names, convertFn, defaultValue)]
-        ret = _FakeProperty(self, name, props)
-        self._props[name] = ret
-        return ret
+        specs = _compositeSpec(name, names, defaultValue, convertFn, defaultInherit)
+        props = [self._addRecord(spec) for spec in specs[:-1]]
+        if self._composites is None:
+            self._composites = dict()
+        self._composites[name] = specs[-1]
+        return _FakeProperty(self, name, props)
+
+    @contextlib.contextmanager
+    def batch(self):
+        # defers property updates until the outermost batch closes, then
+        # recomputes each written property once, walks each subtree once and
+        # fires one change event per property whose value really changed.
+        # If the block raises, the property writes made in it are undone
+        # first; parents and classes changed in it stay changed.
+        global _batch
+        if _batch is not None:
+            yield
+            return
+
+        _batch = _Batch()
+        try:
+            yield
+        except:
+            _batch.rollback()
+            raise
+        finally:
+            batch = _batch
+            batch.flushing = True
+            try:
+                batch.flush()
+            finally:
+                _batch = None
+            batch.sendEvents()
 
     def addListener(self, evt, l):
         try:
@@ -111,10 +243,7 @@ class PropertySet(object):
         return l
 
     def addProperty(self, name, defaultValue=None, convertFn=None, defaultInherit=False):
-        ret = _Property(self, name, defaultValue, convertFn, defaultInherit)
-        self._props[name] = ret
-        self._updateInherit(name, self._parent[name] if self._parent else None)
-        return ret
+        return self._addRecord(_PropertySpec(name, defaultValue, convertFn, defaultInherit))
 
     def addRectProperty(self, name, defaultValue=None, convertFn=None, defaultInherit=False):
         self.addCompositeProperty(name, [name + ext for ext in ['Left', 'Top', 'Right', 'Bottom']],
@@ -124,23 +253,90 @@ class PropertySet(object):
         try:
             return self._props[name]
         except KeyError:
-            prop = self.addProperty(name)
-            return prop
+            pass
+
+        spec = self._getSpec(name)
+        if spec is None:
+            return self._addRecord(_PropertySpec(name))
+        if spec.names is not None:
+            return _FakeProperty(self, name, [self.getProperty(nm) for nm in spec.names])
+        return self._addRecord(spec, spec.computedDefault())
 
     def removeClass(self, cl):
         self._manualClasses.remove(cl)
+        self._refreshStyle()
         self._updateInheritAll()
 
     def removeListener(self, evt, l):
         self._listeners[evt].remove(l)
 
+    def _addRecord(self, spec, computedValue=None):
+        # computedValue is what readers saw before the record existed
+        prop = _Property(self, spec)
+        prop._computedValue = computedValue
+        self._props[spec.name] = prop
+        parent = self._parent
+        prop._updateInherit(parent._inheritedValue(spec.name) if parent else None,
+                            self._classValue(spec.name))
+        return prop
+
     def _classValue(self, nm):
-        for c in self.classes:
-            if nm in c.d:
-                return c.d[nm]
+        return self._styleMap.get(nm)
+
+    def _getSpec(self, name):
+        spec = self._schema.get(name)
+        if spec is None and self._composites is not None:
+            spec = self._composites.get(name)
+        return spec
+
+    def _idChanged(self):
+        # subclass should override
+        pass
+
+    def _inheritedValue(self, name):
+        # the value children inherit for name; a set that does not know the
+        # property passes on its parent's
+        ps = self
+        while ps is not None:
+            if name in ps._props or ps._getSpec(name) is not None:
+                return ps._value(name)
+            ps = ps._parent
         return None
 
+    def _propertyChanged(self, name):
+        # subclass should override
+        pass
+
+    def _refreshStyle(self):
+        # flattens self.classes into one dict, the first class to set a
+        # property wins
+        styleMap = dict()
+        for c in reversed(self.classes):
+            styleMap.update(c.d)
+        self._styleMap = styleMap
+
+        # styled properties need a record to hold their class value
+        for nm in styleMap:
+            if nm not in self._props:
+                spec = self._getSpec(nm)
+                if spec is None:
+                    self._addRecord(_PropertySpec(nm))
+                elif spec.names is None:
+                    self._addRecord(spec, spec.computedDefault())
+
+    def _depth(self):
+        depth = 0
+        p = self._parent
+        while p is not None:
+            depth += 1
+            p = p._parent
+        return depth
+
     def _sendEvent(self, evt, data):
+        if _batch is not None and _batch.flushing:
+            _batch.events.append((self, evt, data))
+            return
+
         try:
             lsts = self._listeners[evt]
         except KeyError:
@@ -161,77 +357,208 @@ class PropertySet(object):
         return False
 
     def _update(self, pname):
-        if self.getProperty(pname)._update():
+        if _batch is not None and not _batch.flushing:
+            _batch.add(self, pname)
+            return
+
+        prop = self.getProperty(pname)
+        if prop._update():
             for c in self._children:
-                c._updateInherit(pname, prop.value, self._classValue(nm))
+                c._updateInherit(pname, prop.value)
 
-    def _updateInherit(self, pname, pvalue):
+    def _receiveInherit(self, pname, pvalue):
+        # returns the value to pass on to the children, _UNSET if nothing
+        # below can change
         try:
             prop = self._props[pname]
-            if not prop._updateInherit(pvalue, self._classValue(pname)):
-                return
-            value = prop.value
         except KeyError:
-            value = pvalue
+            spec = self._schema.get(pname)
+            if spec is None:
+                return pvalue
+            if not spec.defaultInherit or pvalue is None:
+                return _UNSET
+            prop = _Property(self, spec)
+            prop._computedValue = spec.computedDefault()
+            self._props[pname] = prop
+
+        if prop._updateInherit(pvalue, self._classValue(pname)):
+            return prop.value
+        return _UNSET
 
-        for c in self._children:
-            c._updateInherit(pname, value)
+    def _updateInherit(self, pname, pvalue):
+        value = self._receiveInherit(pname, pvalue)
+        if value is not _UNSET:
+            for c in self._children:
+                c._updateInherit(pname, value)
 
-    def _updateInheritAll(self):            
-        if self._parent:
-            for nm in self._parent._props:
-                self._updateInherit(nm, self._parent[nm])
-                
-        for nm in self._props:
-            if not self._parent or nm not in self._parent._props:
-                self._updateInherit(nm, None)
+    def _updateInheritMany(self, values):
+        # like _updateInherit for several properties in a single walk
+        passOn = dict()
+        for pname, pvalue in values.iteritems():
+            value = self._receiveInherit(pname, pvalue)
+            if value is not _UNSET:
+                passOn[pname] = value
+
+        if passOn:
+            for c in self._children:
+                c._updateInheritMany(passOn)
+
+    def _updateInheritAll(self):
+        parent = self._parent
+        names = set(self._props)
+        names.update(self._inheritNames)
+        ps = parent
+        while ps is not None:
+            names.update(ps._props)
+            ps = ps._parent
+
+        for nm in names:
+            self._updateInherit(nm, parent._inheritedValue(nm) if parent else None)
+
+    def _value(self, name):
+        try:
+            return self._props[name]._computedValue
+        except KeyError:
+            pass
+
+        spec = self._getSpec(name)
+        if spec is None:
+            return None
+        if spec.names is not None:
+            return [self._value(nm) for nm in spec.names]
+        return spec.computedDefault()
+
+class _Batch(object):
+    def __init__(self):
+        self.flushing = False
+        self.dirty = collections.OrderedDict()
+        self.events = list()
+        # written state of each property as it was before the batch
+        self.saved = dict()
+
+    def add(self, pset, pname):
+        try:
+            self.dirty[pset].add(pname)
+        except KeyError:
+            self.dirty[pset] = set([pname])
+
+    def save(self, prop):
+        if prop not in self.saved:
+            self.saved[prop] = (prop._value, prop._defaultValue, prop._defaultInherit, prop._inherit)
+
+    def rollback(self):
+        for prop, state in self.saved.iteritems():
+            prop._value, prop._defaultValue, prop._defaultInherit, prop._inherit = state
+
+    def flush(self):
+        # parents first so children see final inherited values
+        for pset in sorted(self.dirty, key=lambda ps: ps._depth()):
+            changed = dict()
+            for pname in self.dirty[pset]:
+                prop = pset.getProperty(pname)
+                if prop._update():
+                    changed[pname] = prop.value
+
+            if changed:
+                for c in pset._children:
+                    c._updateInheritMany(changed)
+
+    def sendEvents(self):
+        for pset, evt, data in self.events:
+            pset._sendEvent(evt, data)
 
 class Component(PropertySet):
+    _properties = (_spec('width', 0, float) +
+                   _spec('height', 0, float) +
+                   _spec('minWidth', 0, float) +
+                   _spec('minHeight', 0, float) +
+                   _spec('maxWidth', float('inf'), float) +
+                   _spec('maxHeight', float('inf'), float) +
+                   _rectSpec('margin', 0, float) +
+                   _rectSpec('padding', 0, float) +
+                   _rectSpec('border', 0, float) +
+                   _spec('borderColor', '#000000', toColor) +
+                   _spec('backgroundColor', '#00000000', toColor) +
+                   _spec('horizontalAlign', 'left', toOrient) +
+                   _spec('verticalAlign', 'right', toOrient))
+    _sizeProperties = _SIZE_PROPERTIES
+    _layoutProperties = frozenset()
+
     def __init__(self, id=''):
 
         super(Component, self).__init__(id)
 
-        self._context = None
-        self._pangoContext = None
-
-        self.addProperty('width', 0, float)
-        self.addProperty('height', 0, float)
-        self.addProperty('minWidth', 0, float)
-        self.addProperty('minHeight', 0, float)
-        self.addProperty('maxWidth', float('inf'), float)
-        self.addProperty('maxHeight', float('inf'), float)
-        self.addRectProperty('margin', 0, float)
-        self.addRectProperty('padding', 0, float)
-        self.addRectProperty('border', 0, float)
-        self.addProperty('borderColor', '#000000', toColor)
-        self.addProperty('backgroundColor', '#00000000', toColor)
-        self.addProperty('horizontalAlign', 'left', toOrient)
-        self.addProperty('verticalAlign', 'right', toOrient)
-
         self._manager = None
+        self._styleKey = None
         self._sizeValid = False
+        self._layoutValid = False
+        self._measuredSize = None
+        self._state = ''
+        self._cacheLayer = False
         self.position = None
         self.size = None
 
-        self.state = ''
         self.types.append('Component')
 
     def __getitem__(self, name):
-        prop = self.getProperty(name)
-        if self.state:
-            sname = '{0}#{1}'.format(name, self.state)
-            if self.getProperty(sname).value is not None:
-                return prop._convertFn(self.getProperty(sname).value)
-        return prop.value
+        if self._state:
+            spec = self._getSpec(name)
+            if spec is not None and spec.names is not None:
+                return [self[nm] for nm in spec.names]
+
+            svalue = self._value('{0}#{1}'.format(name, self._state))
+            if svalue is not None:
+                convertFn = self._props[name]._spec.convertFn if name in self._props else \
+                    (spec.convertFn if spec is not None else None)
+                return convertFn(svalue) if convertFn is not None else svalue
+        return self._value(name)
+
+    @property
+    def _context(self):
+        # the cairo context of the render target currently being drawn
+        return self._manager._targetContext if self._manager is not None else None
+
+    @property
+    def _pangoContext(self):
+        return self._manager._targetPangoContext if self._manager is not None else None
+
+    @property
+    def cacheLayer(self):
+        # when set the subtree is drawn once into its own surface, which is
+        # then composited until something in the subtree repaints
+        return self._cacheLayer
+
+    @cacheLayer.setter
+    def cacheLayer(self, v):
+        v = bool(v)
+        if v != self._cacheLayer:
+            self._cacheLayer = v
+            layerCache.discard(self)
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, s):
+        if s != self._state:
+            names = self._stateNames(self._state) | self._stateNames(s)
+            self._state = s
+            self._invalidateFor(set(nm.split('#', 1)[0] for nm in names))
 
     def computeSize(self):
         # DO NOT override
+        if self._sizeValid:
+            return self._measuredSize
+
         csize = self._computeContentSize()
         space = [self['margin'], self['padding'], self['border']]
         space = [(s[:2], s[2:]) for s in space]
         s0, s1 = zip(*space)
         xspace, yspace = zip(*(s0 + s1))
-        return csize[0] + sum(xspace), csize[1] + sum(yspace)
+        self._measuredSize = csize[0] + sum(xspace), csize[1] + sum(yspace)
+        self._sizeValid = True
+        return self._measuredSize
 
     def onMouseDown(self):
         return False
@@ -245,8 +572,17 @@ class Component(PropertySet):
     def onMouseUp(self):
         return False
 
+    def onMouseWheel(self, delta):
+        return False
+
     def render(self, size):
         # DO NOT override
+        if self._cacheLayer and self._manager is not None:
+            self._renderLayer(size)
+        else:
+            self._paint(size)
+
+    def _paint(self, size):
         margin = self['margin']
         padding = self['padding']
         border = self['border']
@@ -300,33 +636,173 @@ class Component(PropertySet):
         # subclass should override
         return (0, 0)
 
-    def _updateContext(self, mgr, ctx, pangoCtx):
+    def _contentOrigin(self):
+        # top left corner of the content box in window coordinates
+        pos = self._screenPos()
+        if pos is None:
+            return None
+        margin, border, padding = self['margin'], self['border'], self['padding']
+        return pos[0] + margin[0] + border[0] + padding[0], pos[1] + margin[1] + border[1] + padding[1]
+
+    def _invalidateFor(self, names):
+        # invalidates what a change to the properties names can affect
+        if not self._sizeProperties.isdisjoint(names):
+            self._invalidateSize()
+        elif not self._layoutProperties.isdisjoint(names):
+            self._invalidateLayout()
+        self._invalidatePaint()
+
+    def _invalidatePaint(self):
+        if self._manager is not None:
+            if len(layerCache):
+                c = self
+                while c is not None:
+                    if c._cacheLayer:
+                        layerCache.discard(c)
+                    c = c.parent
+            rect = self._screenRect()
+            if rect is not None:
+                self._manager._addDirtyRect(rect)
+
+    def _propertyChanged(self, name):
+        split = name.split('#', 1)
+        if len(split) > 1 and split[1] != self._state:
+            return
+        self._invalidateFor((split[0],))
+
+    def _screenPos(self):
+        if self.position is None:
+            return None
+        if self.parent is None:
+            return tuple(self.position)
+        origin = self.parent._contentOrigin()
+        if origin is None:
+            return None
+        return origin[0] + self.position[0], origin[1] + self.position[1]
+
+    def _screenRect(self):
+        pos = self._screenPos()
+        if pos is None or self.size is None:
+            return None
+        return pos[0], pos[1], self.size[0], self.size[1]
+
+    def _stateNames(self, state):
+        if not state:
+            return set()
+        suffix = '#' + state
+        names = set(nm for nm in self._props if nm.endswith(suffix))
+        for c in self.classes:
+            names.update(nm for nm in c.d if nm.endswith(suffix))
+        return names
+
+    def _idChanged(self):
+        self._updateContext(self._manager)
+
+    def _updateContext(self, mgr):
         self._manager = mgr
-        if self._manager:
-            self._autoClasses = [c for c in self._manager.clist if c.matches(self)]
-        else:
-            self._autoClasses = list()
-        self._updateInheritAll()
-        self._context = ctx
-        self._pangoContext = pangoCtx
+        key = (mgr, mgr._styleVersion, self.id, tuple(self.types)) if mgr is not None else None
+        if key != self._styleKey:
+            self._styleKey = key
+            self._autoClasses = mgr._matchClasses(self) if mgr is not None else list()
+            self._refreshStyle()
+            self._updateInheritAll()
         for c in self._children:
-            c._updateContext(mgr, ctx, pangoCtx)
+            c._updateContext(mgr)
+
+    def _childInvalidateSize(self, c):
+        # subclass may override if its size does not depend on the child
+        self._invalidateSize()
 
     def _invalidateSize(self):
-        if self._sizeValid and self.parent is not None:
-            self._sizeValid = False
+        # once a component is invalid so are all of its ancestors, so the
+        # walk stops at the first one that is already invalid
+        wasValid = self._sizeValid or self._layoutValid
+        self._sizeValid = False
+        self._layoutValid = False
+        if wasValid and self.parent is not None:
             self.parent._childInvalidateSize(self)
 
+    def _invalidateLayout(self):
+        # the children need placing again but the measured size still holds
+        if self._layoutValid:
+            self._layoutValid = False
+            if self.parent is not None:
+                self.parent._invalidateLayout()
+
+    def _performLayout(self, size):
+        # DO NOT override
+        size = tuple(size)
+        if self._layoutValid and self.size == size:
+            return
+        self.size = size
+        # changes made while placing the children are picked up by this pass
+        self._layoutValid = False
+        self._updateLayout(size)
+        self._layoutValid = True
+
+    def _place(self, position, size):
+        # DO NOT override
+        size = tuple(size)
+        if position != self.position or size != self.size:
+            self._invalidatePaint()
+            self.position = position
+            self._performLayout(size)
+            self._invalidatePaint()
+        else:
+            self._performLayout(size)
+
     def _renderContent(self, size):
         # subclass should override
         pass
 
+    def _renderLayer(self, size):
+        # the layer keeps the sub-pixel offset of the component so blitting
+        # it lands on whole device pixels, exactly where drawing would
+        ctx = self._manager._targetContext
+        x, y = ctx.user_to_device(0, 0)
+        fx, fy = x - math.floor(x), y - math.floor(y)
+        recording = isinstance(ctx, _Recorder)
+        key = (size[0], size[1], fx, fy, recording)
+        surface = layerCache.get(self, key)
+        if surface is None:
+            mgr = self._manager
+            target = mgr._targetContext, mgr._targetPangoContext
+            width, height = int(math.ceil(size[0] + fx)), int(math.ceil(size[1] + fy))
+            if recording:
+                # the subtree is recorded too and the rasterizer draws it
+                surface = _RecordedLayer(width, height)
+                layerContext = layerPangoContext = _Recorder([(0, 0, width, height)])
+            else:
+                surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+                layerContext = cairo.Context(surface)
+                layerPangoContext = pangocairo.CairoContext(layerContext)
+            layerContext.set_line_width(0)
+            layerContext.translate(fx, fy)
+            mgr._targetContext, mgr._targetPangoContext = layerContext, layerPangoContext
+            try:
+                self._paint(size)
+            finally:
+                mgr._targetContext, mgr._targetPangoContext = target
+            if recording:
+                ctx.drawLayer(surface, layerContext.ops)
+            else:
+                surface.flush()
+            layerCache.put(self, key, surface)
+
+        ctx.save()
+        if recording:
+            ctx.setLayerSource(surface, -fx, -fy)
+        else:
+            ctx.set_source_surface(surface, -fx, -fy)
+        ctx.paint()
+        ctx.restore()
+
     def _setParent(self, p):
         if super(Component, self)._setParent(p):
             if p:
-                self._updateContext(self._manager, p._context, p._pangoContext)
+                self._updateContext(p._manager)
             else:
-                self._updateContext(None, None, None)
+                self._updateContext(None)
 
     def _updateLayout(self, size):
         # subclass should override
@@ -355,24 +831,33 @@ class Container(Component):
         self._invalidateSize()
 
     def _removeChild(self, c):
+        c._invalidatePaint()
+        c.position = None
         self._children.remove(c)
         self._invalidateSize()
 
     def _renderContent(self, size):
         ctx = self._context
+        x0, y0, x1, y1 = ctx.clip_extents()
         for c in self._children:
+            if c.position[0] >= x1 or c.position[1] >= y1 or c.position[0] + c.size[0] <= x0 \
+                    or c.position[1] + c.size[1] <= y0:
+                continue
             ctx.save()
             ctx.translate(*c.position)
             c.render(c.size)
             ctx.restore()
 
 class Box(Container):
+    _properties = (_spec('orientation', 'horizontal') +
+                   _spec('spacing', 5, int) +
+                   _spec('verticalAlign', 'center', toOrient) +
+                   _spec('horizontalAlign', 'center', toOrient))
+    _sizeProperties = Component._sizeProperties | frozenset(['orientation', 'spacing'])
+    _layoutProperties = frozenset(['horizontalAlign', 'verticalAlign'])
+
     def __init__(self, id = ''):
         super(Box, self).__init__(id)
-        self.addProperty('orientation', 'horizontal')
-        self.addProperty('spacing', 5, int)
-        self.addProperty('verticalAlign', 'center', toOrient)
-        self.addProperty('horizontalAlign', 'center', toOrient)
         self.types.append('Box')
 
     @property
@@ -393,35 +878,41 @@ class Box(Container):
 
     def _computeContentSize(self):
         size = [0, 0]
+        idx0, idx1 = self._idx0, self._idx1
         for c in self._children:
             s = c.computeSize()
-            size[self._idx0] += s[self._idx0]
-            size[self._idx1] = max(size[self._idx1], s[self._idx1])
+            size[idx0] += s[idx0]
+            size[idx1] = max(size[idx1], s[idx1])
 
         spacing = self['spacing']
-        size[self._idx0] += (len(self._children) - 1) * spacing
+        size[idx0] += (len(self._children) - 1) * spacing
         return size
 
     def _updateLayout(self, size):
         pos = [0, 0]
         spacing = self['spacing']
-        for idx, c in enumerate(self._children):
-            c.size = c.computeSize()
-            c._updateLayout(c.size)
-            c.position = list(pos)
-            diff = size[self._idx1] - c.size[self._idx1]
+        idx0, idx1, orient1 = self._idx0, self._idx1, self._orient1
+        sizes = [c.computeSize() for c in self._children]
+        positions = list()
+        for idx, csize in enumerate(sizes):
+            cpos = list(pos)
+            diff = size[idx1] - csize[idx1]
             if diff > 0:
-                c.position[self._idx1] += self._orient1 * diff
+                cpos[idx1] += orient1 * diff
+            positions.append(cpos)
                             
-            pos[self._idx0] += c.size[self._idx0]
+            pos[idx0] += csize[idx0]
             if idx+1 < len(self._children):
-                pos[self._idx0] += spacing
+                pos[idx0] += spacing
 
-        diff = size[self._idx0] - pos[self._idx0]
+        diff = size[idx0] - pos[idx0]
         if diff > 0:
             offset = diff * self._orient0
-            for c in self._children:
-                c.position[self._idx0] += offset
+            for cpos in positions:
+                cpos[idx0] += offset
+
+        for c, cpos, csize in zip(self._children, positions, sizes):
+            c._place(cpos, csize)
 
 class HBox(Box):
     def __init__(self, id = ''):
@@ -429,21 +920,170 @@ class HBox(Box):
         self.types.append('HBox')
 
 class VBox(Box):
+    _properties = _spec('orientation', 'vertical')
+
     def __init__(self, id = '', parent=None):
         super(VBox, self).__init__(id)
-        self.getProperty('orientation').defaultValue = 'vertical'
         self.types.append('VBox')
         self.parent = parent
 
+class ListView(Container):
+    # shows items[i] in rows of a fixed height. Only the rows in view exist
+    # as children; they are made by rowFactory(), filled in by
+    # bindRow(row, item, index) and recycled as the view scrolls.
+    _properties = (_spec('width', 200, float) +
+                   _spec('height', 200, float) +
+                   _spec('rowHeight', 20, float) +
+                   _spec('scroll', 0, float) +
+                   _spec('wheelRows', 3, int))
+    _sizeProperties = Component._sizeProperties | frozenset(['rowHeight'])
+
+    def __init__(self, items=(), rowFactory=None, bindRow=None, id='', parent=None):
+        super(ListView, self).__init__(id)
+        self.types.append('ListView')
+        self._items = items
+        self._rowFactory = rowFactory if rowFactory is not None else Text
+        self._bindRow = bindRow if bindRow is not None else ListView._bindText
+        self._rows = dict()
+        self._spare = list()
+        self.parent = parent
+
+    @property
+    def items(self):
+        return self._items
+
+    @items.setter
+    def items(self, items):
+        self._items = items
+        self.refresh()
+        self._invalidateSize()
+        # fewer items may leave the view scrolled past the last row
+        if self['scroll'] > self.maxScroll:
+            self._scrollBy(0)
+
+    @property
+    def contentHeight(self):
+        return len(self._items) * self['rowHeight']
+
+    @property
+    def maxScroll(self):
+        # the scroll that puts the last row at the bottom of the view
+        return max(self.contentHeight - self._viewportHeight(), 0)
+
+    def refresh(self):
+        # call after changing items in place; rows in view are bound again
+        self._spare.extend(self._rows.itervalues())
+        self._rows = dict()
+        self._invalidateLayout()
+
+    def scrollTo(self, index):
+        self._scrollBy(index * self['rowHeight'] - self['scroll'])
+
+    def onMouseWheel(self, delta):
+        self._scrollBy(-delta * self['wheelRows'] * self['rowHeight'])
+        return True
+
+    @staticmethod
+    def _bindText(row, item, index):
+        row.text = str(item)
+
+    def _addChild(self, c):
+        # rows never change the size of the view itself
+        self._children.append(c)
+        self._invalidateLayout()
+
+    def _removeChild(self, c):
+        c._invalidatePaint()
+        c.position = None
+        self._children.remove(c)
+        self._invalidateLayout()
+
+    def _childInvalidateSize(self, c):
+        self._invalidateLayout()
+
+    def _computeContentSize(self):
+        height = self['height']
+        if height <= 0:
+            height = min(self.contentHeight, self['maxHeight'])
+        return self['width'], height
+
+    def _propertyChanged(self, name):
+        if name == 'scroll':
+            self._invalidateLayout()
+            self._invalidatePaint()
+        else:
+            super(ListView, self)._propertyChanged(name)
+
+    def _renderContent(self, size):
+        ctx = self._context
+        ctx.rectangle(0, 0, size[0], size[1])
+        ctx.clip()
+        super(ListView, self)._renderContent(size)
+
+    def _scrollBy(self, delta):
+        # scroll stays within 0..maxScroll
+        self['scroll'] = min(max(self['scroll'] + delta, 0), self.maxScroll)
+
+    def _viewportHeight(self, size=None):
+        # height of the content box, from the laid out size if there is one
+        if size is None:
+            size = self.size if self.size is not None else self.computeSize()
+        margin, border, padding = self['margin'], self['border'], self['padding']
+        return size[1] - sum(margin[1::2]) - sum(border[1::2]) - sum(padding[1::2])
+
+    def _updateLayout(self, size):
+        margin, border, padding = self['margin'], self['border'], self['padding']
+        width = size[0] - sum(margin[::2]) - sum(border[::2]) - sum(padding[::2])
+        height = self._viewportHeight(size)
+        rowHeight = self['rowHeight']
+        count = len(self._items)
+        scroll = min(self['scroll'], count * rowHeight - height)
+        scroll = max(scroll, 0)
+
+        if rowHeight > 0 and height > 0:
+            first = int(scroll // rowHeight)
+            last = min(int(math.ceil((scroll + height) / rowHeight)), count)
+        else:
+            first = last = 0
+
+        rows = self._rows
+        free = self._spare
+        for index in [i for i in rows if i < first or i >= last]:
+            free.append(rows.pop(index))
+
+        for index in xrange(first, last):
+            row = rows.get(index)
+            if row is None:
+                row = free.pop() if free else self._rowFactory()
+                rows[index] = row
+                if row.parent is not self:
+                    row.parent = self
+                self._bindRow(row, self._items[index], index)
+            row._place((0, index * rowHeight - scroll), (width, rowHeight))
+
+        for row in free:
+            if row.parent is self:
+                row.parent = None
+
 class Manager(Box):
-    def __init__(self, visible=True):
-        super(Manager, self).__init__()
+    def __init__(self, visible=True, threaded=False, id=''):
+        super(Manager, self).__init__(id)
         
         self._size = None
-        cm = CardMaker('card')
-        cm.setFrame(-1, 1, 1, -1)
-        self._card = render2d.attachNewNode(cm.generate())
-        self._card.setAttrib(TransparencyAttrib.make(TransparencyAttrib.MAlpha))
+        self._strips = list()
+        # with threaded set, a worker draws the recorded frame into a back
+        # buffer and render() only copies finished frames into the strips
+        self._threaded = threaded
+        self._rasterizer = None
+        self._maxFps = 0
+        self._nextFrame = 0
+        self._targetContext = None
+        self._targetPangoContext = None
+
+        # cairo renders premultiplied ARGB32, which is BGRA in memory on
+        # little endian machines; that is already Panda's FRgba byte order
+        self._card = render2d.attachNewNode('gui')
+        self._card.setAttrib(TransparencyAttrib.make(TransparencyAttrib.MPremultipliedAlpha))
         self._card.hide()
 
         self._visible = False
@@ -451,11 +1091,21 @@ class Manager(Box):
 
         self.content = None
         self.clist = list()
+        self._selectors = dict()
+        self._styleVersion = 0
+        self._styleValid = True
+        # content hashes of the definition files whose styles were added
+        self._loadedStyles = set()
 
         self._mouseOver = list()
+        self._mousePos = None
+        self._hitIndex = None
+        self._dirty = list()
  
         base.accept('mouse1', self._handleMouseDown)
         base.accept('mouse1-up', self._handleMouseUp)
+        base.accept('wheel_up', self._handleMouseWheel, [1])
+        base.accept('wheel_down', self._handleMouseWheel, [-1])
 
     @property
     def visible(self):
@@ -474,52 +1124,184 @@ class Manager(Box):
                 self._card.hide()
 
     def addClass(self, d, s=''):
-        self.clist.append(PropClass(d, s))
+        cl = PropClass(d, s)
+        self.clist.append(cl)
+        try:
+            self._selectors[s].append(cl)
+        except KeyError:
+            self._selectors[s] = [cl]
+        self._styleVersion += 1
+        self._styleValid = False
+
+    @property
+    def idle(self):
+        # True when the last render() left nothing to restyle, lay out, paint
+        # or pick up from the rasterizer
+        return (self._styleValid and self._layoutValid and not self._dirty and
+                (self._rasterizer is None or not self._rasterizer.busy))
+
+    @property
+    def maxFps(self):
+        # caps how often the overlay is repainted, independent of the frame
+        # rate; 0 repaints whenever something changed
+        return self._maxFps
+
+    @maxFps.setter
+    def maxFps(self, v):
+        self._maxFps = v
+        self._nextFrame = 0
 
     def render(self, task):
-        self._updateMouse()
-        
+        # changes only mark state invalid or dirty, so when nothing changed
+        # this returns after comparing the window size and mouse position
+        if self._maxFps:
+            now = globalClock.getRealTime()
+            if now < self._nextFrame:
+                return True
+
         size = self.resize()
-        ctx = self._context
-        ctx.save()
-        ctx.set_source_rgba(0, 0, 0, 0)
-        ctx.set_operator(cairo.OPERATOR_SOURCE)
-        ctx.paint()
-        ctx.restore()
+        if not self._styleValid:
+            self._styleValid = True
+            self._updateContext(self)
+        if not self._layoutValid:
+            self._performLayout(size)
+            self._hitIndex = None
 
-        ctx.set_line_width(0)
-        super(Manager, self).render(self._size)
+        self._updateMouse()
 
-        self._buffer.setData(self._surface.get_data())
-        self._tex.setup2dTexture(self._size[0], self._size[1], Texture.TUnsignedByte, Texture.FRgba)
-        self._tex.setRamImage(CPTA_uchar(self._buffer), Texture.CMOff)
+        if self._maxFps and self._dirty:
+            self._nextFrame = now + 1.0 / self._maxFps
+
+        if self._threaded:
+            self._swapFrame()
+            return True
+
+        if not self._dirty:
+            return True
+
+        for strip in self._strips:
+            rects = [(x0, max(y0, strip.y), x1, min(y1, strip.y + strip.height))
+                     for x0, y0, x1, y1 in self._dirty
+                     if y0 < strip.y + strip.height and y1 > strip.y]
+            if rects:
+                self._renderStrip(strip, rects)
+        self._dirty = list()
         return True
 
     def resize(self, size=None):
-        props = base.win.getProperties()
-        size = props.getXSize(), props.getYSize()
+        # without a window (window-type none) the size given last is kept
+        if size is None:
+            if base.win is None:
+                size = self._size
+            else:
+                size = base.win.getXSize(), base.win.getYSize()
+        size = tuple(size)
         if self._size == size:
             return size
 
         self._size = size
-        self._data = numpy.empty(size[0] * size[1] * 4, dtype=numpy.int8)
-        self._surface = cairo.ImageSurface.create_for_data(self._data, cairo.FORMAT_ARGB32,
-                                                           size[0], size[1], size[0] * 4)
-        self._buffer = PTA_uchar.emptyArray(self._size[0] * self._size[1] * 4)
-        
-        self._tex = Texture()
-        self._tex.setKeepRamImage(True)
-        self._tex.setup2dTexture(self._size[0], self._size[1], Texture.TUnsignedByte, Texture.FRgba)
-        self._tex.setMagfilter(Texture.FTNearest)
-        self._tex.setMinfilter(Texture.FTNearest)
-        self._card.setTexture(self._tex)
-
-        context = cairo.Context(self._surface)
-        pangoContext = pangocairo.CairoContext(context)
-        self._updateContext(self, context, pangoContext)
-        self._updateLayout(size)
+        self.position = (0, 0)
+        self.size = size
+
+        for strip in self._strips:
+            strip.card.removeNode()
+        if self._rasterizer is not None:
+            self._rasterizer.stop()
+            self._rasterizer = None
+        self._strips = [_Strip(self._card, y, min(_STRIP_HEIGHT, size[1] - y), size)
+                        for y in xrange(0, size[1], _STRIP_HEIGHT)]
+        if self._threaded:
+            self._rasterizer = _Rasterizer(size)
+
+        self._styleValid = True
+        self._updateContext(self)
+        self._layoutValid = False
+        self._addDirtyRect((0, 0) + size)
         return size
 
+    def _matchClasses(self, comp):
+        # a selector names either an id or a type. Classes on a component
+        # rank: its own addClass() calls, then id, then its types from most
+        # to least derived; ties go to the class added to the manager first.
+        ret = list(self._selectors.get(comp.id, ()))
+        for t in reversed(comp.types):
+            for cl in self._selectors.get(t, ()):
+                if cl not in ret:
+                    ret.append(cl)
+        return ret
+
+    def _addDirtyRect(self, rect):
+        if self._size is None:
+            return
+        x0 = max(int(math.floor(rect[0])), 0)
+        y0 = max(int(math.floor(rect[1])), 0)
+        x1 = min(int(math.ceil(rect[0] + rect[2])), self._size[0])
+        y1 = min(int(math.ceil(rect[1] + rect[3])), self._size[1])
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        for d in self._dirty:
+            if d[0] <= x0 and d[1] <= y0 and d[2] >= x1 and d[3] >= y1:
+                return
+        self._dirty.append((x0, y0, x1, y1))
+
+        if len(self._dirty) > _MAX_DIRTY_RECTS:
+            x0s, y0s, x1s, y1s = zip(*self._dirty)
+            self._dirty = [(min(x0s), min(y0s), max(x1s), max(y1s))]
+
+    def _renderStrip(self, strip, rects):
+        self._targetContext = ctx = strip.context
+        self._targetPangoContext = strip.pangoContext
+
+        ctx.save()
+        for x0, y0, x1, y1 in rects:
+            ctx.rectangle(x0, y0, x1 - x0, y1 - y0)
+        ctx.clip()
+
+        ctx.save()
+        ctx.set_source_rgba(0, 0, 0, 0)
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.paint()
+        ctx.restore()
+
+        ctx.set_line_width(0)
+        super(Manager, self).render(self._size)
+        ctx.restore()
+
+        strip.surface.flush()
+        self._uploadStrip(strip)
+
+    def _swapFrame(self):
+        rasterizer = self._rasterizer
+        rects = rasterizer.poll()
+        if rects:
+            for strip in self._strips:
+                rows = [(x0, max(y0, strip.y), x1, min(y1, strip.y + strip.height))
+                        for x0, y0, x1, y1 in rects
+                        if y0 < strip.y + strip.height and y1 > strip.y]
+                if rows:
+                    self._uploadStrip(strip, rows)
+
+        if self._dirty and not rasterizer.busy:
+            # walk the tree into a display list; everything the worker needs
+            # is copied into it, so the tree is free to change afterwards
+            recorder = _Recorder(self._dirty)
+            self._targetContext = self._targetPangoContext = recorder
+            try:
+                super(Manager, self).render(self._size)
+            finally:
+                self._targetContext = self._targetPangoContext = None
+            rasterizer.submit(recorder.ops, self._dirty)
+            self._dirty = list()
+
+    def _uploadStrip(self, strip, rects=()):
+        # rects are copied in from the rasterizer's back buffer first
+        for x0, y0, x1, y1 in rects:
+            strip.pixels[y0 - strip.y:y1 - strip.y, x0:x1] = self._rasterizer.pixels[y0:y1, x0:x1]
+        # cairo drew straight into the RAM image; this only bumps the
+        # modified counter so Panda re-uploads this strip
+        strip.texture.modifyRamImage()
+
     def _handleMouseDown(self):
         for comp in self._mouseOver:
             if comp.onMouseDown():
@@ -530,20 +1312,33 @@ class Manager(Box):
             if comp.onMouseUp():
                 break
 
+    def _handleMouseWheel(self, delta):
+        for comp in self._mouseOver:
+            if comp.onMouseWheel(delta):
+                break
+
     def _updateMouse(self):
-        mwn = base.mouseWatcherNode
-        if mwn.hasMouse():
+        mwn = getattr(base, 'mouseWatcherNode', None)
+        if mwn is not None and mwn.hasMouse():
             pos = Vec2(mwn.getMouseX(), mwn.getMouseY())
             pos += 1
             pos /= 2
             pos.y = 1 - pos.y
-            pos = [int(p * s) for p, s in zip(pos, self._size)]
-            mouseOver = self.under(tuple(pos))
+            pos = tuple([int(p * s) for p, s in zip(pos, self._size)])
         else:
-            mouseOver = list()
-            
-        mouseLeave = [comp for comp in self._mouseOver if comp not in mouseOver]
-        mouseEnter = [comp for comp in mouseOver if comp not in self._mouseOver]
+            pos = None
+
+        if pos == self._mousePos and self._hitIndex is not None:
+            return
+        self._mousePos = pos
+
+        if self._hitIndex is None:
+            self._hitIndex = _HitGrid(self)
+        mouseOver = self._hitIndex.query(pos) if pos is not None else list()
+
+        over, wasOver = set(mouseOver), set(self._mouseOver)
+        mouseLeave = [comp for comp in self._mouseOver if comp not in over]
+        mouseEnter = [comp for comp in mouseOver if comp not in wasOver]
         self._mouseOver = mouseOver
 
         for comp in mouseLeave:
@@ -552,6 +1347,328 @@ class Manager(Box):
         for comp in mouseEnter:
             comp.onMouseEnter()
 
+class _HitGrid(object):
+    # uniform grid over the laid out window rectangles of a component tree.
+    # Entries are stored in depth first order and clipped to their
+    # ancestors, so a query returns the same components as Container.under,
+    # deepest and topmost first.
+    def __init__(self, root):
+        self._cells = dict()
+        self._add(root, 0, 0, 0, 0, float('inf'), float('inf'))
+
+    def query(self, pos):
+        key = (int(pos[0]) // _HIT_CELL_SIZE, int(pos[1]) // _HIT_CELL_SIZE)
+        try:
+            cell = self._cells[key]
+        except KeyError:
+            return list()
+        return [comp for comp, x0, y0, x1, y1 in reversed(cell)
+                if x0 <= pos[0] <= x1 and y0 <= pos[1] <= y1]
+
+    def _add(self, comp, x, y, cx0, cy0, cx1, cy1):
+        if comp.position is None or comp.size is None:
+            return
+        x0, y0 = max(x, cx0), max(y, cy0)
+        x1, y1 = min(x + comp.size[0], cx1), min(y + comp.size[1], cy1)
+        if x1 < x0 or y1 < y0:
+            return
+
+        entry = (comp, x0, y0, x1, y1)
+        for i in xrange(int(x0) // _HIT_CELL_SIZE, int(x1) // _HIT_CELL_SIZE + 1):
+            for j in xrange(int(y0) // _HIT_CELL_SIZE, int(y1) // _HIT_CELL_SIZE + 1):
+                try:
+                    self._cells[(i, j)].append(entry)
+                except KeyError:
+                    self._cells[(i, j)] = [entry]
+
+        if comp._children:
+            margin, border, padding = comp['margin'], comp['border'], comp['padding']
+            ox = x + margin[0] + border[0] + padding[0]
+            oy = y + margin[1] + border[1] + padding[1]
+            for c in comp._children:
+                if c.position is not None:
+                    self._add(c, ox + c.position[0], oy + c.position[1], x0, y0, x1, y1)
+
+class _Strip(object):
+    def __init__(self, parent, y, height, size):
+        self.y = y
+        self.height = height
+
+        self.texture = Texture('gui-{0}'.format(y))
+        self.texture.setKeepRamImage(True)
+        self.texture.setup2dTexture(size[0], height, Texture.TUnsignedByte, Texture.FRgba)
+        self.texture.setMagfilter(Texture.FTNearest)
+        self.texture.setMinfilter(Texture.FTNearest)
+
+        # the cairo surface and the texture share the same memory
+        self._ram = self.texture.modifyRamImage()
+        self._data = numpy.asarray(memoryview(self._ram))
+        self.pixels = self._data.reshape(height, size[0], 4)
+        self.surface = cairo.ImageSurface.create_for_data(self._data, cairo.FORMAT_ARGB32,
+                                                          size[0], height, size[0] * 4)
+        self.context = cairo.Context(self.surface)
+        self.context.translate(0, -y)
+        self.pangoContext = pangocairo.CairoContext(self.context)
+
+        cm = CardMaker('card-{0}'.format(y))
+        cm.setFrame(-1, 1, 1 - 2.0 * y / size[1], 1 - 2.0 * (y + height) / size[1])
+        self.card = parent.attachNewNode(cm.generate())
+        self.card.setTexture(self.texture)
+
+def _record(name):
+    def op(self, *args):
+        self.ops.append((name, args))
+    return op
+
+class _Recorder(object):
+    # stands in for the cairo and pango contexts while the main thread walks
+    # the tree. It tracks the translation and a bounding box of the clip so
+    # clip_extents() and user_to_device() can still be answered. Pango is
+    # not thread safe, so text is recorded as (fontName, fontSize, text)
+    # and laid out again by the rasterizer.
+    def __init__(self, rects):
+        x0s, y0s, x1s, y1s = zip(*rects)
+        self.ops = list()
+        self._offset = (0, 0)
+        self._clip = (min(x0s), min(y0s), max(x1s), max(y1s))
+        self._path = list()
+        self._stack = list()
+
+    def save(self):
+        self._stack.append((self._offset, self._clip))
+        self.ops.append(('save', ()))
+
+    def restore(self):
+        self._offset, self._clip = self._stack.pop()
+        self.ops.append(('restore', ()))
+
+    def translate(self, x, y):
+        self._offset = (self._offset[0] + x, self._offset[1] + y)
+        self.ops.append(('translate', (x, y)))
+
+    def rectangle(self, x, y, w, h):
+        self.ops.append(('rectangle', (x, y, w, h)))
+        x += self._offset[0]
+        y += self._offset[1]
+        self._path.append((x, y, x + w, y + h))
+
+    def clip(self):
+        if self._path:
+            x0s, y0s, x1s, y1s = zip(*self._path)
+            c = self._clip
+            self._clip = (max(c[0], min(x0s)), max(c[1], min(y0s)), min(c[2], max(x1s)), min(c[3], max(y1s)))
+        self._path = list()
+        self.ops.append(('clip', ()))
+
+    def clip_extents(self):
+        ox, oy = self._offset
+        x0, y0, x1, y1 = self._clip
+        return x0 - ox, y0 - oy, max(x0, x1) - ox, max(y0, y1) - oy
+
+    def fill(self):
+        self._path = list()
+        self.ops.append(('fill', ()))
+
+    def stroke(self):
+        self._path = list()
+        self.ops.append(('stroke', ()))
+
+    def user_to_device(self, x, y):
+        return x + self._offset[0], y + self._offset[1]
+
+    paint = _record('paint')
+    set_line_width = _record('set_line_width')
+    set_operator = _record('set_operator')
+    set_source_rgba = _record('set_source_rgba')
+    set_source_surface = _record('set_source_surface')
+    # ops of the rasterizer itself
+    drawLayer = _record('drawLayer')
+    setLayerSource = _record('setLayerSource')
+    showText = _record('showText')
+
+class _RecordedLayer(object):
+    # stands in for the surface of a cached layer until the rasterizer has
+    # drawn it
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.surface = None
+
+    def get_height(self):
+        return self.height
+
+    def get_stride(self):
+        return self.width * 4
+
+class _Rasterizer(object):
+    # owns the back buffer and the thread that replays display lists into it.
+    # Only one frame is in flight; the manager keeps collecting dirty
+    # rectangles until the worker is free again.
+    def __init__(self, size):
+        self.busy = False
+        self.pixels = numpy.zeros((size[1], size[0], 4), numpy.uint8)
+        self._surface = cairo.ImageSurface.create_for_data(self.pixels, cairo.FORMAT_ARGB32,
+                                                           size[0], size[1], size[0] * 4)
+        self._context = pangocairo.CairoContext(cairo.Context(self._surface))
+        # only the worker thread touches these layouts
+        self._layouts = LayoutCache()
+        self._jobs = Queue.Queue()
+        self._done = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='gui-rasterizer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def poll(self):
+        # rectangles of the last finished frame, or None. An exception the
+        # worker hit replaying the frame is raised here instead.
+        try:
+            rects, error = self._done.get_nowait()
+        except Queue.Empty:
+            return None
+        self.busy = False
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return rects
+
+    def stop(self):
+        self._jobs.put(None)
+        self._thread.join()
+
+    def submit(self, ops, rects):
+        self.busy = True
+        self._jobs.put((ops, rects))
+
+    def _run(self):
+        ctx = self._context
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            ops, rects = job
+            error = None
+            try:
+                ctx.save()
+                for x0, y0, x1, y1 in rects:
+                    ctx.rectangle(x0, y0, x1 - x0, y1 - y0)
+                ctx.clip()
+                ctx.save()
+                ctx.set_source_rgba(0, 0, 0, 0)
+                ctx.set_operator(cairo.OPERATOR_SOURCE)
+                ctx.paint()
+                ctx.restore()
+                ctx.set_line_width(0)
+                self._replay(ctx, ops)
+                ctx.restore()
+            except Exception:
+                error = sys.exc_info()
+                # the failed replay may have left saved states behind
+                ctx = self._context = pangocairo.CairoContext(cairo.Context(self._surface))
+            finally:
+                self._surface.flush()
+                # always answer, or busy would stay set for good
+                self._done.put((rects, error))
+
+    def _replay(self, ctx, ops):
+        for name, args in ops:
+            if name == 'showText':
+                ctx.show_layout(self._layouts.get(*args)[0])
+            elif name == 'setLayerSource':
+                layer, x, y = args
+                ctx.set_source_surface(layer.surface, x, y)
+            elif name == 'drawLayer':
+                layer, layerOps = args
+                surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, layer.width, layer.height)
+                self._replay(pangocairo.CairoContext(cairo.Context(surface)), layerOps)
+                surface.flush()
+                layer.surface = surface
+            else:
+                getattr(ctx, name)(*args)
+
+class Profiler(object):
+    # times style resolution, measure, layout, paint and copy per
+    # component. enable() wraps the methods doing that work and disable()
+    # puts the originals back, so a disabled profiler costs nothing.
+    # Each phase also feeds a 'GUI:<phase>' PStats collector; connect with
+    # PStatClient.connect() to see them. copy is handing painted pixels to
+    # the strip textures; Panda uploads those when it draws the frame,
+    # which PStats shows under Draw:Transfer data:Texture.
+    _PHASES = (('style', PropertySet, '_refreshStyle'),
+               ('measure', Component, 'computeSize'),
+               ('layout', Component, '_performLayout'),
+               ('paint', Component, 'render'),
+               ('copy', Manager, '_uploadStrip'))
+
+    def __init__(self):
+        self._originals = None
+        # seconds per phase of each component, held weakly so profiling
+        # does not keep removed subtrees alive
+        self._times = weakref.WeakKeyDictionary()
+        self._stack = list()
+
+    @property
+    def enabled(self):
+        return self._originals is not None
+
+    def disable(self):
+        if self._originals is not None:
+            for cls, name, fn in self._originals:
+                setattr(cls, name, fn)
+            self._originals = None
+
+    def enable(self, pstats=True):
+        if self._originals is not None:
+            return
+        self._originals = list()
+        for phase, cls, name in self._PHASES:
+            fn = cls.__dict__[name]
+            collector = PStatCollector('GUI:' + phase.capitalize()) if pstats else None
+            self._originals.append((cls, name, fn))
+            setattr(cls, name, self._wrap(phase, fn, collector))
+
+    def reset(self):
+        self._times.clear()
+
+    def times(self, comp):
+        # seconds spent in each phase by comp alone, its children excluded
+        return dict(self._times.get(comp, ()))
+
+    def top(self, n=10, phase=None):
+        # the n components that took longest, as (component, seconds)
+        totals = list()
+        for comp, phases in self._times.items():
+            if phase is None:
+                totals.append((comp, sum(phases.itervalues())))
+            elif phase in phases:
+                totals.append((comp, phases[phase]))
+        return heapq.nlargest(n, totals, key=lambda item: item[1])
+
+    def _wrap(self, phase, fn, collector):
+        stack, times, timer = self._stack, self._times, timeit.default_timer
+
+        def wrapper(comp, *args):
+            if collector is not None:
+                collector.start()
+            stack.append(0.0)
+            start = timer()
+            try:
+                return fn(comp, *args)
+            finally:
+                elapsed = timer() - start
+                nested = stack.pop()
+                try:
+                    phases = times[comp]
+                except KeyError:
+                    phases = times[comp] = collections.defaultdict(float)
+                phases[phase] += elapsed - nested
+                if stack:
+                    stack[-1] += elapsed
+                if collector is not None:
+                    collector.stop()
+        wrapper.__name__ = fn.__name__
+        return wrapper
+
+profiler = Profiler()
+
 class PropClass(object):
     def __init__(self, d, s=''):
         self.d = d
@@ -560,13 +1677,152 @@ class PropClass(object):
     def matches(self, comp):
         return self.s in ([comp.id] + comp.types)
         
+_fontCache = dict()
+def _fontDescription(fontName, fontSize):
+    key = (fontName, fontSize)
+    try:
+        return _fontCache[key]
+    except KeyError:
+        font = pango.FontDescription('{0} {1}'.format(fontName, fontSize))
+        _fontCache[key] = font
+        return font
+
+class LayoutCache(object):
+    # process wide LRU of shaped pango layouts. Layouts are measured against
+    # a private context so they can be drawn into any strip or surface.
+    def __init__(self, maxSize=512):
+        self._maxSize = maxSize
+        self._layouts = collections.OrderedDict()
+        self._surface = None
+        self._context = None
+
+    @property
+    def maxSize(self):
+        return self._maxSize
+
+    @maxSize.setter
+    def maxSize(self, v):
+        self._maxSize = v
+        self._trim()
+
+    def clear(self):
+        self._layouts.clear()
+
+    def get(self, fontName, fontSize, text, width=-1):
+        # returns (layout, size in pixels)
+        key = (fontName, fontSize, text, width)
+        try:
+            entry = self._layouts.pop(key)
+        except KeyError:
+            entry = self._create(fontName, fontSize, text, width)
+        self._layouts[key] = entry
+        self._trim()
+        return entry
+
+    def _create(self, fontName, fontSize, text, width):
+        if self._context is None:
+            self._surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
+            self._context = pangocairo.CairoContext(cairo.Context(self._surface))
+
+        layout = self._context.create_layout()
+        layout.set_width(width if width < 0 else int(width * pango.SCALE))
+        layout.set_font_description(_fontDescription(fontName, fontSize))
+        layout.set_text(text)
+        # shapes the text once, later draws reuse the result
+        size = tuple([s / pango.SCALE for s in layout.get_size()])
+        return layout, size
+
+    def _trim(self):
+        while len(self._layouts) > self._maxSize:
+            self._layouts.popitem(last=False)
+
+layoutCache = LayoutCache()
+
+class LayerCache(object):
+    # process wide LRU of the surfaces of components with cacheLayer set,
+    # bounded by the number of bytes their pixels take up. Components are
+    # held weakly, so a layer goes away with its component.
+    def __init__(self, maxBytes=16 << 20):
+        self._maxBytes = maxBytes
+        self._layers = collections.OrderedDict()
+        self._bytes = 0
+        # keys of collected components; weakref callbacks can run in the
+        # middle of any method, so the next call drops their entries
+        self._dead = list()
+
+    def __len__(self):
+        self._purge()
+        return len(self._layers)
+
+    @property
+    def bytes(self):
+        self._purge()
+        return self._bytes
+
+    @property
+    def maxBytes(self):
+        return self._maxBytes
+
+    @maxBytes.setter
+    def maxBytes(self, v):
+        self._maxBytes = v
+        self._trim()
+
+    def clear(self):
+        self._layers.clear()
+        self._bytes = 0
+        del self._dead[:]
+
+    def discard(self, comp):
+        self._purge()
+        entry = self._layers.pop(weakref.ref(comp), None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def get(self, comp, size):
+        # returns the surface drawn for comp at size, or None
+        self._purge()
+        entry = self._layers.pop(weakref.ref(comp), None)
+        if entry is None:
+            return None
+        if entry[0] != size:
+            self._bytes -= entry[2]
+            return None
+        self._layers[entry[3]] = entry
+        return entry[1]
+
+    def put(self, comp, size, surface):
+        self.discard(comp)
+        nbytes = surface.get_stride() * surface.get_height()
+        if nbytes > self._maxBytes:
+            return
+        key = weakref.ref(comp, self._dead.append)
+        self._layers[key] = (size, surface, nbytes, key)
+        self._bytes += nbytes
+        self._trim()
+
+    def _purge(self):
+        while self._dead:
+            entry = self._layers.pop(self._dead.pop(), None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def _trim(self):
+        self._purge()
+        while self._bytes > self._maxBytes:
+            self._bytes -= self._layers.popitem(last=False)[1][2]
+
+layerCache = LayerCache()
+
 class Text(Component):
+    _properties = (_spec('text', '', str) +
+                   _spec('fontSize', 16, int, defaultInherit=True) +
+                   _spec('fontName', 'Sans', str) +
+                   _spec('fontColor', '#000000', toColor, defaultInherit=True))
+    _sizeProperties = Component._sizeProperties | frozenset(['text', 'fontSize', 'fontName'])
+
     def __init__(self, text = '', id = ''):
         super(Text, self).__init__(id)
-        self.addProperty('text', '', str)
-        self.addProperty('fontSize', 16, int, defaultInherit=True)
-        self.addProperty('fontName', 'Sans', str)
-        self.addProperty('fontColor', '#000000', toColor, defaultInherit=True)
         self._layout = None
 
         self.text = text
@@ -581,32 +1837,33 @@ class Text(Component):
         self['text'] = txt
 
     def _computeContentSize(self):
-        layout = self._genLayout()
-        return [s / pango.SCALE for s in layout.get_size()]
+        return self._genLayout()[1]
 
-    def _genLayout(self):
-        pctx = self._pangoContext
-        if self._layout is None:
-            self._layout = pctx.create_layout()
-            self._layout.set_width(-1)
-
-        font = pango.FontDescription('{0} {1}'.format(self['fontName'], self['fontSize']))
-        self._layout.set_font_description(font)
+    def _propertyChanged(self, name):
+        # new text often measures the same as the old, like a counter
+        # ticking over; then the layout around it stands
+        if name == 'text' and self._sizeValid:
+            size = self._measuredSize
+            self._sizeValid = False
+            if self.computeSize() == size:
+                self._invalidatePaint()
+                return
+        super(Text, self)._propertyChanged(name)
 
-        if self._layout.get_text() != self['text']:
-            self._layout.set_text(self['text'])
-            pctx.update_layout(self._layout)
-            
-        return self._layout
+    def _genLayout(self):
+        key = (self['fontName'], self['fontSize'], self['text'])
+        if self._layout is None or self._layout[0] != key:
+            self._layout = key, layoutCache.get(*key)
+        return self._layout[1]
 
     def _renderContent(self, size):
         self._context.set_source_rgba(*self['fontColor'])
-        layout = self._genLayout()
-        self._pangoContext.show_layout(layout)
-
-    def _updateContext(self, mgr, context, pangoContext):
-        self._layout = None
-        super(Text, self)._updateContext(mgr, context, pangoContext)
+        layout = self._genLayout()[0]
+        pangoContext = self._pangoContext
+        if isinstance(pangoContext, _Recorder):
+            pangoContext.showText(*self._layout[0])
+        else:
+            pangoContext.show_layout(layout)
 
 class Button(Text):
     def __init__(self, text = '', id = '', parent=None):
@@ -628,14 +1885,340 @@ class Button(Text):
             self.state = ''
             self._sendEvent('click', None)
 
+class _AtlasPage(object):
+    # one atlas surface filled by shelf packing: images fill a row left to
+    # right, the row is as tall as its tallest image and a new row starts
+    # below it
+    def __init__(self, size):
+        self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+        self.nbytes = self.surface.get_stride() * size
+        # cache keys of the images on this page
+        self.keys = list()
+        # set once surface was handed out; a recorded frame may then still
+        # draw from it on the rasterizer thread, so it is not drawn into again
+        self.shared = False
+        self._size = size
+        self._shelfY = 0
+        self._shelfHeight = 0
+        self._x = 0
+
+    def add(self, surface, width, height):
+        # returns where the image went; only call when fit() found a place
+        x, y = self.fit(width, height)
+        if y != self._shelfY:
+            self._shelfY = y
+            self._shelfHeight = 0
+        if self.shared:
+            # copy on write, leaving the old surface as it was
+            old = self.surface
+            self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self._size, self._size)
+            ctx = cairo.Context(self.surface)
+            ctx.set_operator(cairo.OPERATOR_SOURCE)
+            ctx.set_source_surface(old, 0, 0)
+            ctx.paint()
+            self.shared = False
+        ctx = cairo.Context(self.surface)
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.set_source_surface(surface, x, y)
+        ctx.rectangle(x, y, width, height)
+        ctx.fill()
+        self.surface.flush()
+        self._shelfHeight = max(self._shelfHeight, height)
+        self._x = x + width
+        return x, y
+
+    def fit(self, width, height):
+        # where an image would go, or None if it does not fit
+        size = self._size
+        if self._x + width <= size and self._shelfY + max(self._shelfHeight, height) <= size:
+            return self._x, self._shelfY
+        y = self._shelfY + self._shelfHeight
+        if width <= size and y + height <= size:
+            return 0, y
+        return None
+
+class ImageCache(object):
+    # process wide cache of decoded PNGs, kept at the size they are drawn at
+    # so drawing is a plain blit. It is an LRU bounded by pixel bytes. With
+    # atlas set, images no larger than atlasIconSize are packed into shared
+    # atlas pages instead; a page counts as one entry of the LRU and is
+    # evicted with all of its images.
+    def __init__(self, maxBytes=32 << 20, atlas=False, atlasIconSize=64, atlasPageSize=512):
+        self._maxBytes = maxBytes
+        self.atlas = atlas
+        self.atlasIconSize = atlasIconSize
+        self.atlasPageSize = atlasPageSize
+        self.decodes = 0
+        # bytes of every image key and atlas page, least recently used first
+        self._lru = collections.OrderedDict()
+        self._images = dict()
+        self._atlased = dict()
+        self._pages = list()
+        self._bytes = 0
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def maxBytes(self):
+        return self._maxBytes
+
+    @maxBytes.setter
+    def maxBytes(self, v):
+        self._maxBytes = v
+        self._trim()
+
+    def clear(self):
+        self._lru.clear()
+        self._images.clear()
+        self._atlased.clear()
+        self._pages = list()
+        self._bytes = 0
+
+    def get(self, path, width=0, height=0):
+        # returns (surface, x, y, width, height): the image is the given
+        # rectangle of surface. A width or height of 0 keeps the aspect
+        # ratio, both 0 the natural size.
+        key = (path, width, height)
+        atlased = self._atlased.get(key)
+        if atlased is not None:
+            rect, page = atlased
+            self._touch(page)
+            page.shared = True
+            return (page.surface,) + rect
+        entry = self._images.get(key)
+        if entry is None:
+            surface = self._load(path, width, height)
+            width, height = surface.get_width(), surface.get_height()
+            if self.atlas and max(width, height) <= min(self.atlasIconSize, self.atlasPageSize):
+                page = self._pack(surface, width, height)
+                page.keys.append(key)
+                rect = page.add(surface, width, height) + (width, height)
+                self._atlased[key] = rect, page
+                self._touch(page)
+                self._trim()
+                page.shared = True
+                return (page.surface,) + rect
+            entry = self._images[key] = (surface, 0, 0, width, height)
+            self._lru[key] = surface.get_stride() * height
+            self._bytes += self._lru[key]
+        self._touch(key)
+        self._trim()
+        return entry
+
+    def _load(self, path, width, height):
+        if not width and not height:
+            self.decodes += 1
+            return cairo.ImageSurface.create_from_png(path)
+
+        source, x, y, w, h = self.get(path)
+        width = width or int(round(w * float(height) / h))
+        height = height or int(round(h * float(width) / w))
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(surface)
+        ctx.scale(float(width) / w, float(height) / h)
+        ctx.rectangle(0, 0, w, h)
+        ctx.clip()
+        ctx.set_source_surface(source, -x, -y)
+        ctx.paint()
+        surface.flush()
+        return surface
+
+    def _pack(self, surface, width, height):
+        # the first page with room for the image, or a new one
+        for page in self._pages:
+            if page.fit(width, height) is not None:
+                return page
+        page = _AtlasPage(self.atlasPageSize)
+        self._pages.append(page)
+        self._lru[page] = page.nbytes
+        self._bytes += page.nbytes
+        return page
+
+    def _touch(self, key):
+        self._lru[key] = self._lru.pop(key)
+
+    def _trim(self):
+        # the most recently used entry stays, even when it alone is too big
+        while self._bytes > self._maxBytes and len(self._lru) > 1:
+            key, nbytes = self._lru.popitem(last=False)
+            self._bytes -= nbytes
+            if isinstance(key, _AtlasPage):
+                self._pages.remove(key)
+                for imageKey in key.keys:
+                    del self._atlased[imageKey]
+            else:
+                del self._images[key]
+
+imageCache = ImageCache()
+
+class Image(Component):
+    _properties = (_spec('source', '', str) +
+                   _spec('imageWidth', 0, int) +
+                   _spec('imageHeight', 0, int))
+    _sizeProperties = Component._sizeProperties | frozenset(['source', 'imageWidth', 'imageHeight'])
+
+    def __init__(self, source = '', id = '', parent=None):
+        super(Image, self).__init__(id)
+        self._image = None
+        self.source = source
+        self.types.append('Image')
+        self.parent = parent
+
+    @property
+    def source(self):
+        return self['source']
+
+    @source.setter
+    def source(self, path):
+        self['source'] = path
+
+    def _computeContentSize(self):
+        entry = self._getImage()
+        return (entry[3], entry[4]) if entry is not None else (0, 0)
+
+    def _getImage(self):
+        key = (self['source'], self['imageWidth'], self['imageHeight'])
+        if not key[0]:
+            return None
+        if self._image is None or self._image[0] != key:
+            self._image = key, imageCache.get(*key)
+        return self._image[1]
+
+    def _renderContent(self, size):
+        entry = self._getImage()
+        if entry is None:
+            return
+        surface, x, y, width, height = entry
+        ctx = self._context
+        ctx.save()
+        ctx.rectangle(0, 0, width, height)
+        ctx.clip()
+        ctx.set_source_surface(surface, -x, -y)
+        ctx.paint()
+        ctx.restore()
+
+# easing curves a tween may use, by name
+_EASINGS = ('linear', 'in', 'out', 'inOut')
+
+class Tweener(object):
+    # animates numeric and color properties. All running tweens live in
+    # rows of a few numpy arrays so one frame evaluates them together, and
+    # their new values are written inside a single PropertySet.batch().
+    # A finished or cancelled row is overwritten by the last one, so removal
+    # is O(1). Colors only repaint; sizes and margins relayout as usual.
+    def __init__(self):
+        self._targets = list()
+        self._rows = dict()
+        self._allocate(16)
+        self._task = None
+
+    def __len__(self):
+        return len(self._targets)
+
+    def animate(self, comp, name, to, duration, easing='inOut', onDone=None):
+        # replaces any tween already running on the same property
+        self.cancel(comp, name)
+        spec = comp._getSpec(name)
+        start = comp[name]
+        if spec is None or start is None:
+            raise ValueError('Can not animate {0} of {1}'.format(name, comp))
+        if spec.names is not None:
+            to = [_convert(v, comp._getSpec(nm).convertFn)
+                  for nm, v in zip(spec.names, _makeList(to, len(spec.names)))]
+        else:
+            to = _convert(to, spec.convertFn)
+        scalar = not isinstance(start, (list, tuple))
+        if scalar:
+            start, to = [start], [to]
+
+        row = len(self._targets)
+        if row == len(self._start):
+            self._allocate(row * 2)
+        self._targets.append((comp, name, len(start), scalar, onDone))
+        self._rows[comp, name] = row
+        self._from[row, :len(start)] = start
+        self._to[row, :len(to)] = to
+        self._start[row] = globalClock.getFrameTime()
+        self._duration[row] = max(duration, 1e-6)
+        self._easing[row] = _EASINGS.index(easing)
+        if self._task is None:
+            # runs ahead of Manager.render, which uses the default sort
+            self._task = base.taskMgr.add(self._tick, 'gui-tween', sort=-1)
+
+    def cancel(self, comp, name):
+        row = self._rows.get((comp, name))
+        if row is not None:
+            self._remove(row)
+
+    def update(self, now):
+        n = len(self._targets)
+        if not n:
+            return
+        t = numpy.clip((now - self._start[:n]) / self._duration[:n], 0, 1)
+        # rounding must not keep a tween one frame short of its end
+        t[t > 1 - 1e-9] = 1
+        easing = self._easing[:n]
+        e = numpy.select([easing == 1, easing == 2, easing == 3],
+                         [t * t, t * (2 - t), t * t * (3 - 2 * t)], t)
+        start = self._from[:n]
+        values = start + (self._to[:n] - start) * e[:, numpy.newaxis]
+
+        with self._targets[0][0].batch():
+            for row, (comp, name, width, scalar, onDone) in enumerate(self._targets):
+                v = values[row, :width].tolist()
+                comp[name] = v[0] if scalar else v
+
+        done = list()
+        for row in reversed(numpy.flatnonzero(t >= 1)):
+            done.append(self._targets[row])
+            self._remove(row)
+        for comp, name, width, scalar, onDone in done:
+            if onDone is not None:
+                onDone(comp, name)
+
+    def _allocate(self, size):
+        n = len(self._targets)
+        arrays = [numpy.zeros((size, 4)), numpy.zeros((size, 4)), numpy.zeros(size),
+                  numpy.ones(size), numpy.zeros(size, int)]
+        if n:
+            for new, old in zip(arrays, (self._from, self._to, self._start, self._duration, self._easing)):
+                new[:n] = old[:n]
+        self._from, self._to, self._start, self._duration, self._easing = arrays
+
+    def _remove(self, row):
+        last = len(self._targets) - 1
+        target = self._targets[row]
+        del self._rows[target[0], target[1]]
+        if row != last:
+            moved = self._targets[last]
+            self._targets[row] = moved
+            self._rows[moved[0], moved[1]] = row
+            for array in (self._from, self._to, self._start, self._duration, self._easing):
+                array[row] = array[last]
+        self._targets.pop()
+
+    def _tick(self, task):
+        self.update(globalClock.getFrameTime())
+        if not self._targets:
+            self._task = None
+            return task.done
+        return task.cont
+
+tweener = Tweener()
+
 class _FakeProperty(object):
     def __init__(self, ps, name, props):
         self._pset = ps
 
         self._name = name
         self._props = props
-        self._defaultInherit = all([prop.defaultInherit for prop in props])
         
+    @property
+    def defaultInherit(self):
+        return all([prop.defaultInherit for prop in self._props])
+
     @property
     def defaultValue(self):
         return tuple([prop.defaultValue for prop in self._props])
@@ -668,58 +2251,58 @@ class _FakeProperty(object):
         return self._name
 
     def clone(self, pset):
-        return _FakeProperty(pset, self.name, [prop.name for prop in self._props])
+        return _FakeProperty(pset, self.name, [prop.clone(pset) for prop in self._props])
 
     def _parse(self, v):
         return _makeList(v, len(self._props))
 
-    def _update(self):
-        return False
-
-    def _updateInherit(self, pvalue, cvalue):
-        return False
-        
 class _Property(object):
-    def __init__(self, ps, name, defaultValue, convertFn, defaultInherit):
+    # per instance state of one property; everything shared lives in _spec
+    __slots__ = ('_pset', '_spec', '_defaultValue', '_defaultInherit', '_inherit',
+                 '_inheritValue', '_classValue', '_value', '_computedValue')
+
+    def __init__(self, ps, spec):
         self._pset = ps
-        
-        self._name = name
-        self._defaultValue = defaultValue
-        self._convertFn = convertFn
-        self._defaultInherit = defaultInherit
+        self._spec = spec
+
+        self._defaultValue = _UNSET
+        self._defaultInherit = None
+        self._inherit = None
 
         self._inheritValue = None
         self._classValue = None
         self._value = None
-        self._inherit = None
         
         self._computedValue = None
 
     @property
     def defaultInherit(self):
-        return self._defaultInherit
+        return self._spec.defaultInherit if self._defaultInherit is None else self._defaultInherit
 
     @defaultInherit.setter
     def defaultInherit(self, v):
+        self._save()
         self._defaultInherit = v
         self.markDirty()
 
     @property
     def defaultValue(self):
-        return self._defaultValue
+        return self._spec.defaultValue if self._defaultValue is _UNSET else self._defaultValue
 
     @defaultValue.setter
     def defaultValue(self, v):
+        self._save()
         self._defaultValue = v
         self.markDirty()
 
     @property
     def inherit(self):
-        return self._defaultInherit if self._inherit is None else self._inherit
+        return self.defaultInherit if self._inherit is None else self._inherit
 
     @inherit.setter
-    def inhert(self, v):
+    def inherit(self, v):
         if self._inherit != v:
+            self._save()
             self._inherit = v
             self.markDirty()
 
@@ -730,40 +2313,45 @@ class _Property(object):
     @value.setter
     def value(self, v):
         if self._value != v:
+            self._save()
             self._value = v
             self.markDirty()
 
     @property
     def name(self):
-        return self._name
+        return self._spec.name
+
+    @property
+    def _convertFn(self):
+        return self._spec.convertFn
 
     def clone(self, pset):
-        return _Property(pset, self.name, self._defaultValue, self._convertFn, self._defaultInherit)
+        return _Property(pset, self._spec)
 
     def markDirty(self):
         self._pset._update(self.name)
 
+    def _save(self):
+        # lets a batch that raises put the written state back
+        if _batch is not None and not _batch.flushing:
+            _batch.save(self)
+
     def _update(self):            
         if self._value is not None:
-            newValue = self._value
+            newValue = _convert(self._value, self._spec.convertFn)
         elif self._classValue is not None:
-            newValue = self._classValue
+            newValue = _convert(self._classValue, self._spec.convertFn)
         elif self.inherit and self._inheritValue is not None:
-            newValue = self._inheritValue
+            newValue = _convert(self._inheritValue, self._spec.convertFn)
+        elif self._defaultValue is _UNSET:
+            newValue = self._spec.computedDefault()
         else:
-            newValue = self._defaultValue
-
-        try:
-            newValue = newValue()
-        except TypeError:
-            pass
-
-        if self._convertFn is not None:
-            newValue = self._convertFn(newValue)
+            newValue = _convert(self._defaultValue, self._spec.convertFn)
 
         if newValue != self._computedValue:
             oldValue = self._computedValue
             self._computedValue = newValue
+            self._pset._propertyChanged(self.name)
             self._pset._sendEvent(self.name, (oldValue, newValue))
             return True
         return False
@@ -773,6 +2361,182 @@ class _Property(object):
         self._classValue = cvalue
         return self._update()
 
+# component types a definition file may name
+componentTypes = {
+    'Box': Box,
+    'Button': Button,
+    'HBox': HBox,
+    'Image': Image,
+    'ListView': ListView,
+    'Manager': Manager,
+    'Text': Text,
+    'VBox': VBox,
+}
+
+# node keys that set attributes rather than properties
+_NODE_ATTRIBUTES = frozenset(['cacheLayer', 'items'])
+
+# part of the key of compiled definitions; bump it whenever compileGui()
+# changes what it produces, or a converter such as toColor changes what it
+# returns, so stale .guic files are not loaded. Registering a type or
+# changing a property schema is picked up by _schemaKey() on its own.
+_COMPILED_FORMAT = 3
+
+_compiledCache = dict()
+
+def _plain(v):
+    # json gives unicode strings; the properties expect utf-8 str
+    if isinstance(v, unicode):
+        return v.encode('utf-8')
+    if isinstance(v, list):
+        return [_plain(item) for item in v]
+    if isinstance(v, dict):
+        return dict((_plain(key), _plain(item)) for key, item in v.iteritems())
+    return v
+
+def _classSchema(cls):
+    # factories registered in componentTypes have no schema to resolve with
+    if not isinstance(cls, type) or not issubclass(cls, PropertySet):
+        return dict()
+    if '_schema' not in cls.__dict__:
+        cls._buildSchema()
+    return cls._schema
+
+def _fnName(fn):
+    if fn is None:
+        return ''
+    return '{0}.{1}'.format(getattr(fn, '__module__', ''), getattr(fn, '__name__', repr(fn)))
+
+def _schemaKey():
+    # the registered types and the properties each resolves, as text
+    parts = list()
+    for typeName, cls in sorted(componentTypes.iteritems()):
+        specs = sorted((name, spec.names, _fnName(spec.convertFn))
+                       for name, spec in _classSchema(cls).iteritems())
+        parts.append((typeName, _fnName(cls), specs))
+    return repr(parts)
+
+def _resolve(d, schema):
+    # splits composites such as border into borderLeft, borderTop and so on
+    # and converts every value schema knows, so loading only assigns them
+    ret = dict()
+    for key, v in d.iteritems():
+        split = key.split('#', 1)
+        suffix = key[len(split[0]):]
+        spec = schema.get(split[0])
+        if spec is None:
+            ret[key] = v
+        elif spec.names is not None:
+            for name, item in zip(spec.names, _makeList(v, len(spec.names))):
+                ret[name + suffix] = _convert(item, schema[name].convertFn)
+        else:
+            ret[key] = _convert(v, spec.convertFn)
+    return ret
+
+def compileGui(source):
+    # turns the text of a definition file into the plain tuples loadGui()
+    # builds from: ([(selector, properties)], [node]) where every node is
+    # (type, id, parent index, properties, attributes, events), pre-order.
+    # Properties are resolved against the schema of the type they are for.
+    d = _plain(json.loads(source))
+    # an id selector may match any type
+    anySchema = dict()
+    for cls in componentTypes.itervalues():
+        anySchema.update(_classSchema(cls))
+    styles = list()
+    for style in d.get('styles', ()):
+        style = dict(style)
+        selector = style.pop('selector', '')
+        cls = componentTypes.get(selector)
+        styles.append((selector, _resolve(style, _classSchema(cls) if cls is not None else anySchema)))
+
+    nodes = list()
+    stack = [(d['root'], -1)]
+    while stack:
+        node, parentIndex = stack.pop()
+        node = dict(node)
+        typeName = node.pop('type')
+        if typeName not in componentTypes:
+            raise ValueError('Unknown component type ' + typeName)
+        id = node.pop('id', '')
+        children = node.pop('children', ())
+        events = tuple(sorted(node.pop('on', {}).iteritems()))
+        attrs = tuple((key, node.pop(key)) for key in sorted(_NODE_ATTRIBUTES) if key in node)
+        props = _resolve(node, _classSchema(componentTypes[typeName]))
+        nodes.append((typeName, id, parentIndex, tuple(sorted(props.iteritems())), attrs, events))
+        index = len(nodes) - 1
+        stack.extend((child, index) for child in reversed(children))
+    return styles, nodes
+
+def loadGui(path, parent=None, handlers=None, cacheDir=None):
+    # builds the tree described by a definition file under parent and
+    # returns (root, {id: component}). Compiled definitions are kept per
+    # content hash in memory and, with cacheDir, marshalled on disk.
+    with open(path, 'rb') as f:
+        source = f.read()
+    key = hashlib.sha1('{0}:{1}:{2}'.format(_COMPILED_FORMAT, _schemaKey(), source)).hexdigest()
+    compiled = _compiledCache.get(key)
+    if compiled is None:
+        cachePath = os.path.join(cacheDir, key + '.guic') if cacheDir else None
+        if cachePath:
+            compiled = _readCompiled(cachePath)
+        if compiled is None:
+            compiled = compileGui(source)
+            if cachePath:
+                _writeCompiled(cachePath, compiled)
+        _compiledCache[key] = compiled
+    return _buildGui(key, compiled, parent, handlers or {})
+
+def _readCompiled(path):
+    # None when the file is missing or unreadable, which compiles again
+    try:
+        with open(path, 'rb') as f:
+            styles, nodes = marshal.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    return styles, nodes
+
+def _writeCompiled(path, compiled):
+    # written beside the target and renamed over it, so a crashed or
+    # concurrent write never leaves a truncated file under the final name
+    cacheDir = os.path.dirname(path)
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    fd, temp = tempfile.mkstemp('.tmp', '', cacheDir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(compiled, f)
+        os.rename(temp, path)
+    except OSError:
+        # another process got there first where rename does not replace
+        os.remove(temp)
+
+def _buildGui(key, compiled, parent, handlers):
+    styles, nodes = compiled
+    comps = list()
+    for typeName, id, parentIndex, props, attrs, events in nodes:
+        comp = componentTypes[typeName](id=id)
+        if parentIndex < 0:
+            mgr = comp if isinstance(comp, Manager) else parent
+            if mgr is not None and not isinstance(mgr, Manager):
+                mgr = mgr._manager
+            if mgr is None:
+                raise ValueError('A definition file needs a Manager to attach to')
+            # styles go in first so every component resolves its style once
+            if key not in mgr._loadedStyles:
+                mgr._loadedStyles.add(key)
+                for selector, d in styles:
+                    mgr.addClass(d, selector)
+        for name, v in props:
+            comp[name] = v
+        for name, v in attrs:
+            setattr(comp, name, v)
+        for evt, handler in events:
+            comp.addListener(evt, handlers[handler])
+        comp.parent = comps[parentIndex] if parentIndex >= 0 else parent
+        comps.append(comp)
+    return comps[0], dict((c.id, c) for c in comps if c.id)
+
 if __name__ == '__main__':
     import direct.directbase.DirectStart
 
@@ -0,0 +1,201 @@
+"""Headless benchmarks for gui.py.
+
+Builds synthetic GUI trees and times each stage of a frame on its own:
+property propagation, measuring (computeSize), layout (_updateLayout),
+cairo painting and the texture upload. The upload is the frame that
+uploads the painted strips less an identical frame that uploads
+nothing. Results are written as JSON and can be compared against a
+stored baseline:
+
+    python guibench.py --output bench.json
+    python guibench.py --baseline bench.json --tolerance 0.25
+
+The exit status is 1 when a phase got slower than the baseline allows.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from panda3d.core import loadPrcFileData
+
+def _wide(mgr, scale):
+    # one VBox with many buttons
+    menu = gui.VBox(parent=mgr)
+    for i in xrange(scale * 50):
+        gui.Button('Button {0}'.format(i), parent=menu)
+
+def _deep(mgr, scale):
+    # alternating VBox/HBox nesting with a button at each level
+    parent = mgr
+    for i in xrange(scale * 10):
+        box = gui.VBox() if i % 2 else gui.HBox()
+        box.parent = parent
+        gui.Button('Level {0}'.format(i), parent=box)
+        parent = box
+
+def _text(mgr, scale):
+    # panels of long labels
+    panel = gui.VBox(parent=mgr)
+    for i in xrange(scale * 10):
+        row = gui.HBox()
+        row.parent = panel
+        for j in xrange(5):
+            t = gui.Text('Lorem ipsum dolor sit amet {0}.{1}'.format(i, j))
+            t.parent = row
+
+def _list(mgr, scale):
+    # a virtualized list; cost should follow the rows in view only
+    gui.ListView(['Row {0}'.format(i) for i in xrange(scale * 1000)], parent=mgr)
+
+CASES = {
+    'wide': _wide,
+    'deep': _deep,
+    'text': _text,
+    'list': _list,
+}
+
+def _style(mgr):
+    cl = {'fontColor': '#00ff00', 'backgroundColor': '#000000', 'borderColor': '#00ff00'}
+    cl.update(gui.rectDict('border', 1))
+    cl.update(gui.rectDict('padding', 3))
+    mgr.addClass(cl, 'Button')
+
+def _frame(mgr):
+    # everything render() does before painting
+    mgr.resize()
+    if not mgr._styleValid:
+        mgr._styleValid = True
+        mgr._updateContext(mgr)
+
+def runCase(name, scale, size, repeat):
+    mgr = gui.Manager()
+    mgr.resize(size)
+    _style(mgr)
+    CASES[name](mgr, scale)
+    mgr.render(None)
+    # a threaded manager needs more frames to pick up the worker's result
+    while not mgr.idle:
+        time.sleep(0.001)
+        mgr.render(None)
+    if base.win is not None:
+        # the first frame also sets up the GSG and creates the textures
+        base.graphicsEngine.renderFrame()
+
+    timings = dict((phase, list()) for phase in ('propagate', 'measure', 'layout', 'paint', 'upload'))
+    for i in xrange(repeat):
+        # an inherited property set on the root reaches every Text
+        t = time.time()
+        mgr['fontSize'] = 12 + i % 2
+        timings['propagate'].append(time.time() - t)
+
+        _frame(mgr)
+        t = time.time()
+        mgr.computeSize()
+        timings['measure'].append(time.time() - t)
+
+        t = time.time()
+        mgr._performLayout(mgr._size)
+        timings['layout'].append(time.time() - t)
+        # render() would rebuild the hit grid after a layout; do it here so
+        # only painting is timed
+        mgr._hitIndex = gui._HitGrid(mgr)
+
+        mgr._addDirtyRect((0, 0) + mgr._size)
+        t = time.time()
+        mgr.render(None)
+        timings['paint'].append(time.time() - t)
+
+        if base.win is not None:
+            # the frame after painting uploads the strip textures; a second
+            # frame with nothing to upload costs the rest (cull and draw),
+            # which is taken off
+            t = time.time()
+            base.graphicsEngine.renderFrame()
+            dirty = time.time() - t
+            t = time.time()
+            base.graphicsEngine.renderFrame()
+            timings['upload'].append(max(dirty - (time.time() - t), 0.0))
+
+    mgr.visible = False
+    return dict((phase, _median(values) if values else None) for phase, values in timings.iteritems())
+
+def compare(results, baseline, tolerance, floor=0.001):
+    # returns (case, phase, baseline, result) for every regression. Phases
+    # faster than floor seconds in both runs are timer noise and skipped.
+    regressions = list()
+    for case, phases in sorted(results.iteritems()):
+        for phase, value in sorted(phases.iteritems()):
+            old = baseline.get(case, {}).get(phase)
+            if value is None or not old or max(value, old) < floor:
+                continue
+            if value > old * (1 + tolerance):
+                regressions.append((case, phase, old, value))
+    return regressions
+
+def addReportOptions(parser):
+    # the options report() reads
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against a JSON file written by --output')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown relative to the baseline')
+    parser.add_argument('--floor', type=float, default=0.001,
+                        help='ignore phases faster than this many seconds when comparing')
+
+def report(args, results, **settings):
+    # writes results and the settings they were taken with to --output and
+    # compares them against --baseline; returns the exit status
+    if args.output:
+        data = dict(settings, python=platform.python_version(), platform=platform.platform(),
+                    results=results)
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance, args.floor)
+        for case, phase, old, new in regressions:
+            print 'REGRESSION {0}.{1}: {2:.4f}s -> {3:.4f}s'.format(case, phase, old, new)
+        if regressions:
+            return 1
+    return 0
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the gui module without a display.')
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help='case to run, may be repeated (default: all)')
+    parser.add_argument('--scale', type=int, default=4, help='size multiplier of the synthetic trees')
+    parser.add_argument('--repeat', type=int, default=5, help='timed frames per case')
+    parser.add_argument('--size', type=int, nargs=2, default=(1024, 768), metavar=('W', 'H'))
+    parser.add_argument('--window-type', default='offscreen', choices=('offscreen', 'none'),
+                        help="'none' skips the upload phase")
+    addReportOptions(parser)
+    args = parser.parse_args(argv)
+
+    loadPrcFileData('', 'window-type {0}\nwin-size {1} {2}\naudio-library-name null\n'
+                        'notify-level error'.format(args.window_type, *args.size))
+    import direct.directbase.DirectStart
+    global gui
+    import gui
+
+    results = dict()
+    for name in args.case or sorted(CASES):
+        results[name] = runCase(name, args.scale, args.size, args.repeat)
+        print '{0:8}'.format(name), ' '.join('{0}={1}'.format(phase, '-' if v is None else '%.4f' % v)
+                                             for phase, v in sorted(results[name].iteritems()))
+
+    return report(args, results, scale=args.scale, repeat=args.repeat, size=list(args.size),
+                  windowType=args.window_type)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Runs the game without a window.
+
+The same galaxy, fleet and order logic as starfighter.py, driven by a
+fixed-step loop with no graphics pipe: for dedicated servers, AI training
+and soak tests on machines without a display.
+
+    python headless.py --ticks 10000 --ships 5000
+    python headless.py --seconds 60 --realtime
+
+Every --orders ticks a random star becomes a target and a random group of
+ships is sent to it. Ticks per second are printed every --report seconds
+and once more at the end. Without --ticks or --seconds it runs until
+interrupted.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy
+
+from game import Game, SEED, TICK_RATE
+
+class _Orders(object):
+    # a simulation callback that sends a random group of ships to a random
+    # star every interval ticks
+    def __init__(self, game, interval, groupSize, seed):
+        self.game = game
+        self.interval = interval
+        self.groupSize = groupSize
+        self.given = 0
+        self._rng = numpy.random.RandomState(seed)
+        self._ticks = 0
+
+    def __call__(self, dt):
+        self._ticks += 1
+        if self._ticks % self.interval:
+            return
+        stars, ships = self.game.starStore.ids(), self.game.shipStore.ids()
+        if not len(stars) or not len(ships):
+            return
+        self.game.addTarget(self.game.starStore['position'][self._rng.choice(stars)])
+        group = self._rng.choice(ships, min(self.groupSize, len(ships)), replace=False)
+        self.game.addToGroup(group.tolist())
+        self.given += 1
+
+def _status(game, ticks, seconds):
+    return {
+        'ticks': game.simulation.ticks,
+        'simulatedSeconds': game.simulation.time,
+        'seconds': seconds,
+        'ticksPerSecond': ticks / seconds if seconds else None,
+        'ships': len(game.shipStore),
+        'moving': int(game.fleet.moving.sum()),
+        'groups': len(game.targetStack),
+    }
+
+def _print(status, out):
+    tps = status['ticksPerSecond']
+    print >> out, 'ticks={0} tps={1} ships={2} moving={3} groups={4}'.format(
+        status['ticks'], '-' if tps is None else '%.1f' % tps, status['ships'], status['moving'], status['groups'])
+
+def run(game, ticks=None, seconds=None, realtime=False, report=5.0, out=sys.stdout):
+    # ticks the game until ticks ticks or seconds seconds have passed, as
+    # fast as it goes or, with realtime, at the simulation's rate; returns
+    # the final status
+    simulation = game.simulation
+    start = last = lastReport = time.time()
+    lastTicks = simulation.ticks
+    try:
+        while (ticks is None or simulation.ticks < ticks) and (seconds is None or last - start < seconds):
+            if realtime:
+                # sleep until the next tick is due, then run what is due
+                time.sleep(max(0.0, (1 - simulation.alpha) * simulation.step))
+                now = time.time()
+                simulation.advance(now - last)
+                last = now
+            else:
+                simulation.tick()
+                last = time.time()
+            if report and last - lastReport >= report:
+                _print(_status(game, simulation.ticks - lastTicks, last - lastReport), out)
+                lastReport, lastTicks = last, simulation.ticks
+    except KeyboardInterrupt:
+        last = time.time()
+    return _status(game, simulation.ticks, last - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the game without a window.')
+    parser.add_argument('--ticks', type=int, help='stop after this many ticks')
+    parser.add_argument('--seconds', type=float, help='stop after this many seconds')
+    parser.add_argument('--realtime', action='store_true',
+                        help='tick at --rate instead of as fast as possible')
+    parser.add_argument('--rate', type=float, default=TICK_RATE, help='ticks per simulated second')
+    parser.add_argument('--stars', type=int, default=10)
+    parser.add_argument('--dist', type=float, default=15, help='size of the galaxy')
+    parser.add_argument('--ships', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--orders', type=int, default=30, help='ticks between random orders, 0 for none')
+    parser.add_argument('--group', type=int, default=10, help='ships per random order')
+    parser.add_argument('--report', type=float, default=5.0, help='seconds between reports, 0 for none')
+    parser.add_argument('--output', help='write the final status to this JSON file')
+    args = parser.parse_args(argv)
+
+    game = Game(stars=args.stars, dist=args.dist, ships=args.ships, shipDist=args.dist,
+                seed=args.seed, rate=args.rate)
+    if args.orders:
+        orders = _Orders(game, args.orders, args.group, args.seed)
+        game.simulation.add(orders)
+    status = run(game, args.ticks, args.seconds, args.realtime, args.report)
+    _print(status, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(status, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
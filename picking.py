@@ -0,0 +1,351 @@
+import math
+
+import numpy
+
+from direct.showbase.DirectObject import DirectObject
+from panda3d.core import Point3
+
+from cells import cellKey, cellKeys, unpack
+
+def _expand(lo, hi):
+    # every cell of each inclusive range lo..hi, as (index of the range,
+    # cell) per cell; empty ranges (hi below lo) have none
+    extent = numpy.maximum(hi - lo + 1, 0)
+    counts = extent[:, 0] * extent[:, 1] * extent[:, 2]
+    index = numpy.repeat(numpy.arange(len(lo)), counts)
+    k = numpy.arange(len(index)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    extent = extent[index]
+    offsets = numpy.empty((len(index), 3), lo.dtype)
+    offsets[:, 2] = k % extent[:, 2]
+    k //= extent[:, 2]
+    offsets[:, 1] = k % extent[:, 1]
+    offsets[:, 0] = k // extent[:, 1]
+    return index, lo[index] + offsets
+
+def _any(rows):
+    # rows.any(1) for three columns, without the slow small-axis reduce
+    return rows[:, 0] | rows[:, 1] | rows[:, 2]
+
+def _within(cells, lo, hi):
+    inside = (cells >= lo) & (cells <= hi)
+    return inside[:, 0] & inside[:, 1] & inside[:, 2]
+
+class PickIndex(object):
+    # a uniform grid over the bounding spheres of pickable things. Each
+    # thing has a key (anything hashable, e.g. ('star', 3)) and is listed
+    # in every cell its bounds overlap, so a ray only looks at the things
+    # in the cells it passes through. The listing is one array of (cell
+    # key, slot) pairs sorted by cell, so moves are applied in batches of
+    # array operations. Positions are also kept in one array
+    # for the rectangle queries. Every thing has a slot in these arrays;
+    # callers that move many things each frame keep the slots addMany()
+    # returned and call moveSlots() to skip looking keys up. A move only
+    # writes the position; the grid catches up on the next ray, so things
+    # moving every simulation tick are relisted at most once a ray.
+    def __init__(self, cellSize=4.0):
+        self.cellSize = float(cellSize)
+        # bumped whenever something is added, moved or removed
+        self.version = 0
+        self._cellKeys = numpy.empty(0, numpy.int64)
+        self._cellSlots = numpy.empty(0, numpy.int64)
+        self._slots = dict()
+        self._keys = list()
+        self._free = list()
+        self._positions = numpy.zeros((16, 3), numpy.float32)
+        self._radii = numpy.zeros(16, numpy.float32)
+        # the cell range (inclusive) each slot is listed in
+        self._lo = numpy.zeros((16, 3), numpy.int32)
+        self._hi = numpy.full((16, 3), -1, numpy.int32)
+        self._live = numpy.zeros(16, bool)
+        # slots moved since the grid was last brought up to date
+        self._stale = numpy.zeros(16, bool)
+        self._anyStale = False
+        # range of cells that ever had something in them
+        self._bounds = None
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, key, pos, radius):
+        self.addMany([key], [pos], radius)
+
+    def addMany(self, keys, positions, radii):
+        # radii is one radius for all or one per key; returns the slots
+        slots = numpy.empty(len(keys), numpy.int64)
+        for i, key in enumerate(keys):
+            if key in self._slots:
+                raise KeyError('Already indexed: ' + repr(key))
+            if self._free:
+                slot = self._free.pop()
+                self._keys[slot] = key
+            else:
+                slot = len(self._keys)
+                self._keys.append(key)
+            self._slots[key] = slots[i] = slot
+        self._grow(len(self._keys))
+        self._radii[slots] = radii
+        self._live[slots] = True
+        self.moveSlots(slots, positions)
+        return slots
+
+    def move(self, key, pos):
+        self.moveSlots([self._slots[key]], [pos])
+
+    def moveMany(self, keys, positions):
+        # positions is an n x 3 array
+        slots = numpy.fromiter((self._slots[key] for key in keys), numpy.int64, len(keys))
+        self.moveSlots(slots, positions)
+
+    def moveSlots(self, slots, positions):
+        # moves the things in slots; the grid is updated by the next ray
+        slots = numpy.asarray(slots, numpy.int64)
+        self._positions[slots] = numpy.asarray(positions, numpy.float32).reshape(-1, 3)
+        self._stale[slots] = True
+        self._anyStale = True
+        self.version += 1
+
+    def remove(self, key):
+        slot = self._slots.pop(key)
+        self._stale[slot] = False
+        self._relist(numpy.array([slot]), numpy.zeros((1, 3), numpy.int32),
+                     numpy.full((1, 3), -1, numpy.int32))
+        self._keys[slot] = None
+        self._live[slot] = False
+        self._free.append(slot)
+        self.version += 1
+
+    def position(self, key):
+        return tuple(self._positions[self._slots[key]])
+
+    def ray(self, origin, direction, accept=None):
+        # (key, distance along direction) of the nearest thing the ray hits,
+        # or None. accept(key) can rule things out.
+        self._catchUp()
+        if self._bounds is None:
+            return None
+        origin = [float(v) for v in origin]
+        direction = [float(v) for v in direction]
+        length = math.sqrt(sum(v * v for v in direction))
+        if not length:
+            return None
+        direction = [v / length for v in direction]
+
+        # clip the ray to the occupied cells
+        size = self.cellSize
+        lo, hi = self._bounds
+        near, far = 0.0, float('inf')
+        for axis in xrange(3):
+            low, high = lo[axis] * size, (hi[axis] + 1) * size
+            if direction[axis]:
+                t0 = (low - origin[axis]) / direction[axis]
+                t1 = (high - origin[axis]) / direction[axis]
+                near, far = max(near, min(t0, t1)), min(far, max(t0, t1))
+            elif not low <= origin[axis] <= high:
+                return None
+        if near > far:
+            return None
+
+        # walk the cells along the ray (Amanatides & Woo). Everything that
+        # could be hit in a cell is listed in it, so once a hit is nearer
+        # than where the walk leaves a cell no later cell can do better.
+        start = [origin[axis] + direction[axis] * near for axis in xrange(3)]
+        cell = [min(max(int(math.floor(start[axis] / size)), lo[axis]), hi[axis]) for axis in xrange(3)]
+        step, tMax, tDelta = [0] * 3, [float('inf')] * 3, [float('inf')] * 3
+        for axis in xrange(3):
+            if direction[axis] > 0:
+                step[axis] = 1
+                tMax[axis] = ((cell[axis] + 1) * size - origin[axis]) / direction[axis]
+                tDelta[axis] = size / direction[axis]
+            elif direction[axis] < 0:
+                step[axis] = -1
+                tMax[axis] = (cell[axis] * size - origin[axis]) / direction[axis]
+                tDelta[axis] = -size / direction[axis]
+
+        best = None
+        tested = set()
+        keys = self._cellKeys
+        while True:
+            key = cellKey(*cell)
+            start = keys.searchsorted(key)
+            # most cells are empty, which the first search already shows
+            stop = keys.searchsorted(key, 'right') if start < len(keys) and keys[start] == key else start
+            for slot in self._cellSlots[start:stop].tolist():
+                if slot in tested:
+                    continue
+                tested.add(slot)
+                t = self._hit(slot, origin, direction)
+                if t is not None and (best is None or t < best[1]) and \
+                        (accept is None or accept(self._keys[slot])):
+                    best = (self._keys[slot], t)
+            axis = tMax.index(min(tMax))
+            if best is not None and best[1] <= tMax[axis]:
+                return best
+            if tMax[axis] > far:
+                return best
+            cell[axis] += step[axis]
+            if not lo[axis] <= cell[axis] <= hi[axis]:
+                return best
+            tMax[axis] += tDelta[axis]
+
+    def rect(self, corner0, corner1, camera=None, lens=None):
+        # keys of everything whose center is drawn inside the rectangle
+        # between two film positions (as given by mouseWatcherNode.getMouse())
+        camera = camera if camera is not None else base.cam
+        lens = lens if lens is not None else base.camLens
+        count = len(self._keys)
+        if not count:
+            return []
+        m = render.getMat(camera) * lens.getProjectionMat()
+        m = numpy.array([list(m.getRow(i)) for i in xrange(4)], numpy.float32)
+        clip = numpy.dot(self._positions[:count], m[:3]) + m[3]
+        w = clip[:, 3]
+        inside = self._live[:count] & (w > 0)
+        film = clip[:, :2] / numpy.where(inside, w, 1)[:, numpy.newaxis]
+        for axis in xrange(2):
+            low, high = sorted((corner0[axis], corner1[axis]))
+            inside &= (film[:, axis] >= low) & (film[:, axis] <= high)
+        return [self._keys[slot] for slot in numpy.flatnonzero(inside)]
+
+    def _catchUp(self):
+        # relists the moved things whose cell range changed, in one batch
+        if not self._anyStale:
+            return
+        self._anyStale = False
+        slots = numpy.flatnonzero(self._stale)
+        self._stale[slots] = False
+        positions = self._positions[slots]
+        radii = self._radii[slots][:, numpy.newaxis]
+        lo = numpy.floor((positions - radii) / self.cellSize).astype(numpy.int32)
+        hi = numpy.floor((positions + radii) / self.cellSize).astype(numpy.int32)
+        changed = numpy.flatnonzero(_any((lo != self._lo[slots]) | (hi != self._hi[slots])))
+        if len(changed):
+            lo, hi = lo[changed], hi[changed]
+            self._relist(slots[changed], lo, hi)
+            low, high = lo.min(0), hi.max(0)
+            if self._bounds is not None:
+                low = numpy.minimum(low, self._bounds[0])
+                high = numpy.maximum(high, self._bounds[1])
+            self._bounds = (low, high)
+
+    def _grow(self, count):
+        used = capacity = len(self._radii)
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
+        for name in ('_positions', '_radii', '_lo', '_hi', '_live', '_stale'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self._hi[used:] = -1
+
+    def _hit(self, slot, origin, direction):
+        # distance along the ray to the slot's sphere, or None
+        center = self._positions[slot]
+        r = float(self._radii[slot])
+        d = [origin[axis] - float(center[axis]) for axis in xrange(3)]
+        b = sum(d[axis] * direction[axis] for axis in xrange(3))
+        c = sum(v * v for v in d) - r * r
+        disc = b * b - c
+        if disc < 0:
+            return None
+        t = -b - math.sqrt(disc)
+        if t < 0:
+            t = -b + math.sqrt(disc)
+            if t < 0:
+                return None
+            # the ray starts inside the sphere
+            return 0.0
+        return t
+
+    def _relist(self, slots, lo, hi):
+        # lists slots in the cells lo..hi instead of their current ones.
+        # Pairs for cells in both ranges are left alone.
+        oldLo, oldHi = self._lo[slots], self._hi[slots]
+        self._lo[slots] = lo
+        self._hi[slots] = hi
+
+        moving = numpy.zeros(len(self._lo), bool)
+        moving[slots] = True
+        listed = numpy.flatnonzero(moving[self._cellSlots])
+        owners = self._cellSlots[listed]
+        gone = listed[~_within(unpack(self._cellKeys[listed]), self._lo[owners], self._hi[owners])]
+
+        index, cells = _expand(lo, hi)
+        added = ~_within(cells, oldLo[index], oldHi[index])
+        addKeys = cellKeys(cells[added])
+        order = numpy.argsort(addKeys)
+        addKeys = addKeys[order]
+        addSlots = slots[index[added]][order]
+
+        keep = numpy.ones(len(self._cellKeys), bool)
+        keep[gone] = False
+        keys = self._cellKeys[keep]
+        at = keys.searchsorted(addKeys)
+        self._cellKeys = numpy.insert(keys, at, addKeys)
+        self._cellSlots = numpy.insert(self._cellSlots[keep], at, addSlots)
+
+class Picker(DirectObject):
+    # answers what is under the mouse from a PickIndex. The ray is only
+    # cast again when the mouse, the camera or the index changed since the
+    # last frame. Dragging with the left button selects everything drawn
+    # inside the dragged rectangle and sends the keys with the 'pick-drag'
+    # event. keyFilter(key) can rule things out of hovering.
+    def __init__(self, index, camera=None, lens=None, dragDistance=0.02, keyFilter=None):
+        self.index = index
+        self.camera = camera if camera is not None else base.cam
+        self.lens = lens if lens is not None else base.camLens
+        self.dragDistance = dragDistance
+        self.keyFilter = keyFilter
+        # key of the thing under the mouse, or None
+        self.hit = None
+        self._state = None
+        self._dragStart = None
+        self.accept('mouse1', self._pressed)
+        self.accept('mouse1-up', self._released)
+        self._task = taskMgr.add(self._update, 'picker', sort=-1)
+
+    def destroy(self):
+        taskMgr.remove(self._task)
+        self.ignoreAll()
+
+    def _mouse(self):
+        watcher = getattr(base, 'mouseWatcherNode', None)
+        if watcher is None or not watcher.hasMouse():
+            return None
+        mpos = watcher.getMouse()
+        return mpos.getX(), mpos.getY()
+
+    def _pressed(self):
+        self._dragStart = self._mouse()
+
+    def _released(self):
+        start, end = self._dragStart, self._mouse()
+        self._dragStart = None
+        if start is None or end is None:
+            return
+        if max(abs(end[0] - start[0]), abs(end[1] - start[1])) >= self.dragDistance:
+            messenger.send('pick-drag', [self.index.rect(start, end, self.camera, self.lens)])
+
+    def _update(self, task):
+        mpos = self._mouse()
+        if mpos is None:
+            self.hit = None
+            self._state = None
+            return task.cont
+        mat = self.camera.getMat(render)
+        state = (mpos, tuple(mat.getRow(3)), tuple(mat.getRow(2)), tuple(mat.getRow(1)),
+                 tuple(mat.getRow(0)), self.index.version)
+        if state != self._state:
+            self._state = state
+            near, far = Point3(), Point3()
+            self.lens.extrude(mpos, near, far)
+            near = render.getRelativePoint(self.camera, near)
+            far = render.getRelativePoint(self.camera, far)
+            hit = self.index.ray(near, far - near, self.keyFilter)
+            self.hit = hit[0] if hit is not None else None
+        return task.cont
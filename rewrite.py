@@ -6,9 +6,6 @@ from pandac.PandaModules import *
 from panda3d.core import Texture, TextureStage
 from pandac.PandaModules import TransparencyAttrib 
 from direct.gui.OnscreenImage import OnscreenImage
-import direct.directbase.DirectStart
-from panda3d.core import CollisionTraverser,CollisionNode
-from panda3d.core import CollisionHandlerQueue,CollisionRay
 from panda3d.core import AmbientLight,DirectionalLight,LightAttrib
 from panda3d.core import TextNode
 from panda3d.core import Point3,Vec3,Vec4,BitMask32
@@ -16,6 +13,10 @@ from direct.gui.OnscreenText import OnscreenText
 from direct.showbase.DirectObject import DirectObject
 from direct.task.Task import Task
 from random import * 
+from starfield import EntityView
+from entities import FLAG_HIGHLIGHT
+from picking import Picker
+from game import Game
 import sys
 
 
@@ -24,29 +25,34 @@ BLACK = Vec4(0,0,0,1)
 WHITE = Vec4(1,1,1,1)
 HIGHLIGHT = Vec4(0,1,1,1)
 
+#How far the camera moves in a second while a key is held
+CAMERA_SPEED = 15.0
+
 #Now we define some helper functions that we will need later
 
 def PointAtZ(z, point, vec):
   return point + vec * ((z-point.getZ()) / vec.getZ())
 
-#A handy little function for getting the proper position for a given square
-def starPos(dist):
-  return random()*dist, random()*dist, random()*dist
-
 class World(DirectObject):
   def __init__(self):
-    #make some stars
+    #the game holds the stars; World draws it and feeds it input
+    self.game = Game(stars=10, dist=10, ships=0)
     self.initCamera()
     self.initPicker()
-    self.stars = self.makeStars(10, 10)
+    self.stars = self.makeStars()
+    #the camera moves along with the game, in fixed ticks
+    self.simulation = self.game.simulation
+    self.simulation.add(self.cameraTick)
+    self.simulation.start()
     taskMgr.add(self.moveCameraTask, "MoveCameraTask")
     taskMgr.add(self.mouseTask, 'mouseTask')  
+    taskMgr.add(self.syncViewsTask, 'syncViewsTask', sort=40)
 	
-  def makeStars(self, number, dist):
-    starEntities = []
-    for i in range(number):
-      starEntities.append(Star(dist,i))
-    return starEntities
+  def makeStars(self):
+    #the view draws the game's stars as one point sprite geom
+    stars = self.game.starStore
+    self.starView = EntityView(stars, HIGHLIGHT, size=2)
+    return stars
     
   def initCamera(self):
 	#initialize a camera
@@ -61,92 +67,64 @@ class World(DirectObject):
     #define positional variables
     self.nx = 0.0
     self.ny = 0.0
-	  #set up mouse picking
-    self.picker = CollisionTraverser()            #Make a traverser
-    self.pq = CollisionHandlerQueue()         #Make a handler
-    self.pickerNode = CollisionNode('mouseRay')
-    self.pickerNP = base.camera.attachNewNode(self.pickerNode)
-    self.pickerNode.setFromCollideMask(BitMask32.bit(1))
-    self.pickerRay = CollisionRay()               #Make our ray
-    self.pickerNode.addSolid(self.pickerRay)      #Add it to the collision node
-    self.picker.addCollider(self.pickerNP, self.pq)
+    #the camera moves while these keys are held
+    self.keys = {"w": 0, "s": 0, "a": 0, "d": 0}
+    self.lastCamera = (self.nx, self.ny)
+    for key in self.keys:
+      self.accept(key, self.setKey, [key, 1])
+      self.accept(key + "-up", self.setKey, [key, 0])
+	  #set up mouse picking: the game keeps the stars in a spatial index, and
+	  #the picker only casts a new ray when the mouse or camera moved
+    self.picker = Picker(self.game.pickIndex)
 	
   def mouseTask(self, task):
     if self.hiSq is not False:
-      self.stars[self.hiSq].model.setColor(WHITE)
+      self.stars.clearFlags(self.hiSq, FLAG_HIGHLIGHT)
       self.hiSq = False
 	  #define some temp variables
     i = None
     #Check to see if we can access the mouse. We need it to do anything else
     if base.mouseWatcherNode.hasMouse():
-      #get the mouse position
-      mpos = base.mouseWatcherNode.getMouse()
-      #Set the position of the ray based on the mouse position
-      self.pickerRay.setFromLens(base.camNode, mpos.getX(), mpos.getY())
-      self.starNode = render.attachNewNode("starnode")
-      for star in self.stars:
-        star.model.reparentTo(self.starNode)
-      self.picker.traverse(self.starNode)
-      if self.pq.getNumEntries() > 0:
-        self.pq.sortEntries()
-        try:
-          i = int(self.pq.getEntry(0).getIntoNode().getTag('star'))
-        except:
-          i = None
-        #Set the highlight on the picked square
-        if i: self.stars[i].model.setColor(HIGHLIGHT)
-        if i: self.hiSq = i
-        if i: self.highlighted = (self.stars[i].getPosition())
+      #the picker keeps what is under the mouse as a (kind, index) key
+      if self.picker.hit is not None:
+        i = self.picker.hit[1]
+      #Set the highlight on the picked square
+      if i is not None:
+        self.stars.setFlags(i, FLAG_HIGHLIGHT)
+        self.hiSq = i
+        self.highlighted = tuple(self.stars['position'][i])
 	
 	#allow the user to input a destination
     #if i: self.accept("mouse1", self.updateTarget)
     return Task.cont
 
+  def syncViewsTask(self, task):
+    #copy what changed in the star store to the scene graph, once a frame
+    self.starView.sync()
+    return Task.cont
+
+  def setKey(self, key, value):
+    self.keys[key] = value
+
+  def cameraTick(self, dt):
+    #held keys move the camera CAMERA_SPEED units a second
+    self.lastCamera = (self.nx, self.ny)
+    self.nx += (self.keys["d"] - self.keys["a"]) * CAMERA_SPEED * dt
+    self.ny += (self.keys["w"] - self.keys["s"]) * CAMERA_SPEED * dt
+
+  #update camera position
   def moveCameraTask(self, task):
-    #handle key presses
-    self.accept("w", self.moveForward)
-    self.accept("s", self.moveBack)
-    self.accept("d", self.moveRight)
-    self.accept("a", self.moveLeft)
-    #handle continued key press
-    self.accept("w-repeat", self.moveForward)
-    self.accept("s-repeat", self.moveBack)
-    self.accept("d-repeat", self.moveRight)
-    self.accept("a-repeat", self.moveLeft)
-		
-    base.camera.setPos(self.nx, self.ny, 20)
+    #draw the camera between where the last two ticks put it
+    a = self.simulation.alpha
+    x, y = self.lastCamera
+    base.camera.setPos(x + (self.nx - x) * a, y + (self.ny - y) * a, 20)
     #self.camera.lookAt(self.testShip)
     base.camera.setHpr(0,-75,0)
     return Task.cont
-  # Define procedures to move the camera.
-  def moveForward(self):
-     self.ny += 0.5
-  def moveBack(self):
-    self.ny -= 0.5
-  def moveRight(self):
-    self.nx += 0.5
-  def moveLeft(self):
-    self.nx -= 0.5
-
-class Star(DirectObject):
-  def __init__(self, dist, i):
-    self.pos = (random() * dist, random() * dist, random() * dist)
-    self.model = loader.loadModel("models/square")
-    self.model.setPos(starPos(dist))
-    self.model.setColor(WHITE)
-    self.model.find("**/polygon").node().setIntoCollideMask(BitMask32.bit(1))
-    self.model.find("**/polygon").node().setTag('star', str(i))
-    t1 = loader.loadTexture("sprites/star1.png")
-    t2 = TextureStage("sprites/star1.png")
-    self.model.setTexture(t2, t1)	
-    self.model.setScale(2,2,2)	
-    self.model.setTransparency(1)
-  def getPosition(self):
-    return self.pos 
-    
 
-	
-#Do the main initialization and start 3D rendering
-w = World()
-run()
+#Do the main initialization and start 3D rendering (headless.py runs the game without a window)
+if __name__ == '__main__':
+  import direct.directbase.DirectStart
+  w = World()
+  run()
 
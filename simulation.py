@@ -0,0 +1,99 @@
+class Simulation(object):
+    # advances game logic in fixed ticks of 1 / rate seconds, however long
+    # the rendered frames take. Each frame adds its time to an accumulator
+    # and as many ticks run as fit, at most maxSteps; time beyond that is
+    # dropped so a slow machine falls behind instead of spiralling. alpha
+    # is how far the frame is between the last tick and the next one, for
+    # drawing things between where they were and where they are.
+    def __init__(self, rate=30.0, maxSteps=5, timeScale=1.0):
+        self.rate = rate
+        self.maxSteps = maxSteps
+        # simulated seconds per real second
+        self.timeScale = timeScale
+        self.ticks = 0
+        self.time = 0.0
+        self.alpha = 0.0
+        # real seconds lost to the maxSteps cap
+        self.dropped = 0.0
+        self._accumulator = 0.0
+        self._callbacks = list()
+        self._tracked = dict()
+        self._task = None
+
+    @property
+    def rate(self):
+        return 1.0 / self.step
+
+    @rate.setter
+    def rate(self, value):
+        self.step = 1.0 / value
+
+    def add(self, callback):
+        # callback(dt) runs every tick, in the order added
+        self._callbacks.append(callback)
+
+    def advance(self, elapsed):
+        # runs the ticks that fit into elapsed more real seconds; returns
+        # how many ran
+        self._accumulator += elapsed * self.timeScale
+        steps = 0
+        while self._accumulator >= self.step and steps < self.maxSteps:
+            self._accumulator -= self.step
+            self.tick()
+            steps += 1
+        if self._accumulator >= self.step:
+            excess = self._accumulator - self._accumulator % self.step
+            self.dropped += excess / self.timeScale
+            self._accumulator -= excess
+        self.alpha = self._accumulator / self.step
+        return steps
+
+    def interpolated(self, store, column='position'):
+        # the tracked column blended from the tick before the last to the
+        # last by alpha, or None if the last tick did not change it
+        previous, before, after = self._tracked[store, column]
+        if previous is None or before == after:
+            return None
+        current = store[column]
+        count = min(len(previous), len(current))
+        blended = current.copy()
+        blended[:count] += (previous[:count] - current[:count]) * (1 - self.alpha)
+        return blended
+
+    def remove(self, callback):
+        self._callbacks.remove(callback)
+
+    def run(self, ticks):
+        # runs ticks right away, as fast as they go
+        for i in xrange(ticks):
+            self.tick()
+
+    def start(self, sort=-10):
+        # advances with the frame time from a Panda task
+        if self._task is None:
+            self._task = taskMgr.add(self._advanceTask, 'simulation', sort=sort)
+
+    def stop(self):
+        if self._task is not None:
+            taskMgr.remove(self._task)
+            self._task = None
+
+    def tick(self):
+        for key in self._tracked:
+            store, column = key
+            self._tracked[key] = [store[column].copy(), store.versions[column], None]
+        for callback in list(self._callbacks):
+            callback(self.step)
+        for key, tracked in self._tracked.iteritems():
+            tracked[2] = key[0].versions[key[1]]
+        self.ticks += 1
+        self.time += self.step
+
+    def track(self, store, column='position'):
+        # keeps the column of an EntityStore from before each tick, for
+        # interpolated()
+        self._tracked[store, column] = [None, None, None]
+
+    def _advanceTask(self, task):
+        self.advance(globalClock.getDt())
+        return task.cont
@@ -0,0 +1,168 @@
+import numpy
+
+from panda3d.core import Geom, GeomNode, GeomPoints, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat
+from panda3d.core import InternalName, TexGenAttrib, Texture, TextureStage, TransparencyAttrib
+
+from entities import FLAG_HIGHLIGHT
+
+# one row of the vertex table: position and an RGBA8 color, 16 bytes a star
+_ROW = numpy.dtype([('position', numpy.float32, 3), ('color', numpy.uint8, 4)])
+
+# up to this many rows of changed colors are patched in place; more are
+# uploaded with the rest of the table
+_PATCH_ROWS = 64
+
+_format = None
+def _vertexFormat():
+    global _format
+    if _format is None:
+        array = GeomVertexArrayFormat()
+        array.addColumn(InternalName.getVertex(), 3, Geom.NTFloat32, Geom.CPoint)
+        array.addColumn(InternalName.getColor(), 4, Geom.NTUint8, Geom.CColor)
+        _format = GeomVertexFormat.registerFormat(GeomVertexFormat(array))
+    return _format
+
+_glow = None
+def glowTexture(size=32):
+    # a soft round dot, white with the alpha falling off to the edge
+    global _glow
+    if _glow is None:
+        r = numpy.hypot(*numpy.mgrid[-1:1:size * 1j, -1:1:size * 1j])
+        alpha = numpy.clip(1 - r, 0, 1) ** 2
+        image = numpy.empty((size, size, 4), numpy.uint8)
+        image[..., :3] = 255
+        image[..., 3] = (alpha * 255).astype(numpy.uint8)
+        _glow = Texture('star-glow')
+        _glow.setup2dTexture(size, size, Texture.TUnsignedByte, Texture.FRgba)
+        _glow.setRamImage(image.tostring())
+    return _glow
+
+def _toColors(colors, count):
+    # uint8 arrays are taken as they are, anything else as 0..1 like Vec4
+    colors = numpy.asarray(colors if colors is not None else (1.0, 1.0, 1.0, 1.0))
+    if colors.dtype != numpy.uint8:
+        colors = numpy.clip(colors * 255.0 + 0.5, 0, 255)
+    return numpy.broadcast_to(colors.astype(numpy.uint8), (count, 4))
+
+class StarField(object):
+    # draws every star as one point of a single GeomPoints, so the whole
+    # field is one node and one draw call. Points are drawn as camera facing
+    # sprites sized in world units; Panda expands them to quads itself where
+    # the renderer has no point sprites (tinydisplay), so this works headless.
+    def __init__(self, positions, colors=None, size=0.5, parent=None, texture=None, name='stars'):
+        positions = numpy.asarray(positions, numpy.float32).reshape(-1, 3)
+        self._rows = numpy.zeros(len(positions), _ROW)
+        self._rows['position'] = positions
+        self._rows['color'] = _toColors(colors, len(positions))
+
+        self._data = GeomVertexData(name, _vertexFormat(), Geom.UHDynamic)
+        self._data.uncleanSetNumRows(len(self._rows))
+        self._upload()
+
+        points = GeomPoints(Geom.UHStatic)
+        points.addConsecutiveVertices(0, len(self._rows))
+        geom = Geom(self._data)
+        geom.addPrimitive(points)
+        node = GeomNode(name)
+        node.addGeom(geom)
+
+        self.nodePath = (parent if parent is not None else render).attachNewNode(node)
+        self.nodePath.setRenderModePerspective(True)
+        self.nodePath.setRenderModeThickness(size)
+        self.nodePath.setTexGen(TextureStage.getDefault(), TexGenAttrib.MPointSprite)
+        self.nodePath.setTexture(texture if texture is not None else glowTexture())
+        self.nodePath.setTransparency(TransparencyAttrib.MAlpha)
+        self.nodePath.setDepthWrite(False)
+        self.nodePath.setLightOff()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def positions(self):
+        return self._rows['position']
+
+    @property
+    def colors(self):
+        return self._rows['color']
+
+    def setColor(self, index, color):
+        self._rows['color'][index] = _toColors(color, 1)[0]
+        start = index * _ROW.itemsize
+        handle = self._data.modifyArray(0).modifyHandle()
+        handle.setSubdata(start, _ROW.itemsize, self._rows[index:index + 1].tostring())
+
+    def setColors(self, colors):
+        self.setRows(colors=colors)
+
+    def setPositions(self, positions):
+        self.setRows(positions)
+
+    def setRows(self, positions=None, colors=None):
+        # replaces whichever of the two is given, in a single upload
+        if positions is not None:
+            self._rows['position'] = numpy.asarray(positions, numpy.float32).reshape(-1, 3)
+        if colors is not None:
+            self._rows['color'] = _toColors(colors, len(self._rows))
+        self._upload()
+
+    def _upload(self):
+        self._data.modifyArray(0).modifyHandle().copyDataFrom(self._rows.tostring())
+
+class EntityView(object):
+    # draws every row of an EntityStore as a sprite of a StarField. The
+    # store is the truth: sync() copies the position column, and the color
+    # column (if any) with the highlight flag applied, whenever their
+    # versions changed. Dead rows are drawn fully transparent.
+    def __init__(self, store, highlight=(0.0, 1.0, 1.0, 1.0), **fieldArgs):
+        self.store = store
+        self.highlight = _toColors(highlight, 1)[0]
+        self.field = None
+        self._fieldArgs = fieldArgs
+        self._versions = None
+
+    def destroy(self):
+        if self.field is not None:
+            self.field.nodePath.removeNode()
+            self.field = None
+
+    def sync(self, positions=None):
+        # positions, if given, are drawn instead of the position column,
+        # e.g. positions interpolated between simulation ticks
+        store = self.store
+        versions = (store.size, store.versions['position'], store.versions['flags'],
+                    store.versions.get('color'))
+        if positions is None and versions == self._versions:
+            return
+        old, self._versions = self._versions, versions
+        interpolated = positions is not None
+        if self.field is None or len(self.field) != store.size:
+            self.destroy()
+            self.field = StarField(store['position'] if positions is None else positions,
+                                   self._colors(), **self._fieldArgs)
+        else:
+            if positions is None and versions[1] != old[1]:
+                positions = store['position']
+            colors = self._colors() if versions[2:] != old[2:] else None
+            if colors is not None and positions is None:
+                # usually only a few rows changed, e.g. what is hovered
+                rows = numpy.flatnonzero((colors != self.field.colors).any(1))
+                if len(rows) <= _PATCH_ROWS:
+                    for row in rows:
+                        self.field.setColor(row, colors[row])
+                    colors = None
+            if positions is not None or colors is not None:
+                self.field.setRows(positions, colors)
+        if interpolated:
+            # the column itself is not drawn; upload it on the next plain sync
+            self._versions = versions[:1] + (None,) + versions[2:]
+
+    def _colors(self):
+        store = self.store
+        if store.hasColumn('color'):
+            colors = _toColors(store['color'], store.size).copy()
+        else:
+            colors = numpy.full((store.size, 4), 255, numpy.uint8)
+        colors[(store['flags'] & FLAG_HIGHLIGHT) != 0] = self.highlight
+        colors[~store.alive] = 0
+        return colors